@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Latency of operator posts while the posting path is congested
+
+A slow stand-in logbook server is flooded with automated posts through
+``HutchELog.set`` while operator notes are posted through
+``HutchELog.post``. The latency of the operator notes is reported once with
+every post at the same priority, i.e. first-in first-out, and once with the
+operator notes at ``Priority.INTERACTIVE``.
+
+Usage:
+
+    python benchmarks/post_priority.py --bulk 2000 --delay 0.005
+"""
+import argparse
+import statistics
+import time
+
+from elog import HutchELog, PostScheduler, Priority
+from elog.mock_server import MockLogbook, MockLogbookServer
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(server, args, operator_priority):
+    scheduler = PostScheduler(max_workers=args.workers)
+    el = HutchELog('TST', user='bench', pw='bench', base_url=server.url,
+                   primary=False, scheduler=scheduler)
+    # Flood the scheduler with automated posts
+    statuses = [el.set(f'Automated post {i}', priority=Priority.BULK)
+                for i in range(args.bulk)]
+    latencies = list()
+    for i in range(args.operator):
+        start = time.monotonic()
+        el.post(f'Operator note {i}', priority=operator_priority)
+        latencies.append(time.monotonic() - start)
+        time.sleep(args.spacing)
+    for status in statuses:
+        status.wait(timeout=600)
+    scheduler.shutdown()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--bulk', type=int, default=1000,
+                        help='Number of automated posts to queue')
+    parser.add_argument('--operator', type=int, default=20,
+                        help='Number of operator posts to time')
+    parser.add_argument('--spacing', type=float, default=0.05,
+                        help='Time in seconds between operator posts')
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help='Time in seconds the server takes per request')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of concurrent posts')
+    args = parser.parse_args()
+
+    logbook = MockLogbook(experiments={'TST': 'tstx12345'}, delay=args.delay,
+                          max_concurrency=args.workers)
+    with MockLogbookServer(logbook) as server:
+        print(f'{args.bulk} automated posts, {args.operator} operator posts, '
+              f'{args.delay * 1000:.0f} ms per request, '
+              f'{args.workers} workers')
+        print(f'{"scheduling":<12}{"p50":>10}{"p95":>10}{"p99":>10}'
+              f'{"max":>10}')
+        for label, priority in (('fifo', Priority.BULK),
+                                ('priority', Priority.INTERACTIVE)):
+            latencies = run(server, args, priority)
+            print(f'{label:<12}'
+                  f'{statistics.median(latencies) * 1000:>8.1f}ms'
+                  f'{percentile(latencies, 95) * 1000:>8.1f}ms'
+                  f'{percentile(latencies, 99) * 1000:>8.1f}ms'
+                  f'{max(latencies) * 1000:>8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
 from .version import __version__  # noqa: F401
 
-__all__ = ['ELog', 'HutchELog']
+__all__ = ['AttachmentCache', 'ELog', 'FacilityELog', 'HutchELog',
+           'IncrementalEntry', 'MetadataCache', 'PostScheduler', 'Priority',
+           'RunSummaryCallback']
 
-from .elog import ELog, HutchELog
+from .cache import AttachmentCache, MetadataCache
+from .callbacks import RunSummaryCallback
+from .elog import ELog, FacilityELog, HutchELog
+from .entry import IncrementalEntry
+from .scheduler import PostScheduler, Priority
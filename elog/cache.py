@@ -0,0 +1,360 @@
+"""
+Local caches of data read from the ELog
+"""
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentCache:
+    """
+    Content-addressed on-disk cache of attachments
+
+    Attachments are stored once per unique content under
+    ``<directory>/objects``, named by their SHA-256 digest, while
+    ``<directory>/keys`` maps each attachment to its digest. Files are
+    written to a temporary name and renamed into place, so any number of
+    processes on a node can share one cache directory.
+
+    The total size of the objects is kept near ``max_bytes`` by removing the
+    least recently used objects. Reading an object refreshes its
+    modification time, which serves as the recency for every process.
+    Eviction is checked whenever this process has written more than a
+    twentieth of ``max_bytes`` since the last check.
+
+    Usage:
+
+        .. code-block:: python
+
+            cache = AttachmentCache('~/.cache/elog', max_bytes=2 * 1024**3)
+            service = PHPWebService(attachment_cache=cache)
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the cache. It is created if it does not exist
+
+    max_bytes : int, optional
+        Approximate upper bound on the size of the cache
+
+    mmap_threshold : int, optional
+        Objects of at least this many bytes are memory-mapped rather than
+        read into memory
+    """
+    def __init__(self, directory, max_bytes=1024**3, mmap_threshold=1024**2):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        self._objects = os.path.join(self.directory, 'objects')
+        self._keys = os.path.join(self.directory, 'keys')
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._keys, exist_ok=True)
+        self._lock = threading.Lock()
+        self._written = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups in this process served from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def metrics(self):
+        """Counters of the cache use by this process"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'bytes_saved': self.bytes_saved}
+
+    def _key_path(self, key):
+        return os.path.join(self._keys,
+                            hashlib.sha256(key.encode()).hexdigest())
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def _write(self, path, content):
+        """Atomically write a file"""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get(self, key):
+        """
+        Read an attachment from the cache
+
+        Parameters
+        ----------
+        key : str
+            Identifier of the attachment
+
+        Returns
+        -------
+        content : bytes, memoryview or None
+            None if the attachment is not cached. Large attachments are
+            returned as a read-only view of a memory-mapped file
+        """
+        try:
+            with open(self._key_path(key)) as f:
+                digest = f.read().strip()
+            path = self._object_path(digest)
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size and size >= self.mmap_threshold:
+                    content = memoryview(mmap.mmap(f.fileno(), 0,
+                                                   access=mmap.ACCESS_READ))
+                else:
+                    content = f.read()
+        except FileNotFoundError:
+            # Either never cached or evicted by another process
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+        return content
+
+    def put(self, key, content):
+        """
+        Store an attachment in the cache
+
+        Parameters
+        ----------
+        key : str
+            Identifier of the attachment
+
+        content : bytes
+            Content of the attachment
+
+        Returns
+        -------
+        digest : str
+            SHA-256 digest the content is stored under
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write(path, content)
+        self._write(self._key_path(key), digest.encode())
+        with self._lock:
+            self._written += len(content)
+            check = self._written > self.max_bytes / 20
+            if check:
+                self._written = 0
+        if check:
+            self.evict()
+        return digest
+
+    def fetch(self, key, load):
+        """
+        Return a cached attachment, loading and caching it if needed
+
+        Parameters
+        ----------
+        key : str
+            Identifier of the attachment
+
+        load : callable
+            Called without arguments to retrieve the content on a miss
+        """
+        content = self.get(key)
+        if content is None:
+            content = load()
+            self.put(key, content)
+        return content
+
+    def evict(self):
+        """
+        Remove the least recently used objects until under max_bytes
+
+        Keys of objects that no longer exist are removed as well.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            objects, total = list(), 0
+            for root, _, files in os.walk(self._objects):
+                for name in files:
+                    # Skip files that are still being written
+                    if name.endswith('.tmp'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    objects.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            # Leave some headroom so eviction is not needed on every write
+            target = 0.9 * self.max_bytes
+            for _, size, path in sorted(objects):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                logger.debug("Evicted %s from attachment cache", path)
+                if total <= target:
+                    break
+            self._remove_dangling_keys()
+
+    def _remove_dangling_keys(self):
+        """Remove keys whose object has been evicted"""
+        for name in os.listdir(self._keys):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self._keys, name)
+            try:
+                with open(path) as f:
+                    digest = f.read().strip()
+                if not os.path.exists(self._object_path(digest)):
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+
+class MetadataCache:
+    """
+    In-memory cache of JSON responses honouring HTTP validators
+
+    Each response is stored along with its ``ETag`` and ``Last-Modified``
+    headers. Later requests for the same URL send these back as
+    ``If-None-Match`` and ``If-Modified-Since``, so that when nothing has
+    changed the web service answers 304 without a body and the stored value
+    is reused without parsing any JSON.
+
+    Callers that can tolerate slightly stale data may also accept a stored
+    value younger than ``max_stale`` seconds immediately. The value is then
+    revalidated in a background thread for the next caller
+    (stale-while-revalidate).
+
+    Usage:
+
+        .. code-block:: python
+
+            service = PHPWebService(metadata_cache=MetadataCache())
+            service.get_experiment_logbook('XPP', max_stale=60)
+    """
+    def __init__(self):
+        self._entries = dict()
+        self._revalidating = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def metrics(self):
+        """Counters of requests served from the cache"""
+        return {'hits': self.hits, 'revalidated': self.revalidated,
+                'misses': self.misses}
+
+    def clear(self):
+        """Forget every stored response"""
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, url, fetch, max_stale=None):
+        """
+        Return the JSON document at a URL
+
+        Parameters
+        ----------
+        url : str
+            URL of the document, used as the key of the cache
+
+        fetch : callable
+            Called as ``fetch(headers)`` with the conditional request headers
+            and returns the ``requests.Response``. It should raise for HTTP
+            errors other than 304
+
+        max_stale : float, optional
+            Accept a stored value up to this many seconds old without
+            waiting for the web service
+
+        Returns
+        -------
+        document : dict
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is not None and max_stale is not None:
+            value, _, fetched = entry
+            if time.monotonic() - fetched <= max_stale:
+                with self._lock:
+                    self.hits += 1
+                    revalidate = url not in self._revalidating
+                    self._revalidating.add(url)
+                if revalidate:
+                    threading.Thread(target=self._revalidate,
+                                     args=(url, fetch), daemon=True,
+                                     name='MetadataCache').start()
+                return value
+        return self._fetch(url, fetch)
+
+    def _revalidate(self, url, fetch):
+        try:
+            self._fetch(url, fetch)
+        except Exception:
+            logger.exception("Failed to revalidate %s", url)
+        finally:
+            with self._lock:
+                self._revalidating.discard(url)
+
+    def _fetch(self, url, fetch):
+        with self._lock:
+            entry = self._entries.get(url)
+        headers = dict()
+        if entry is not None:
+            validators = entry[1]
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        response = fetch(headers)
+        if response.status_code == 304 and entry is None:
+            # No validators were sent, yet something between us and the web
+            # service answered as if they were. There is nothing to reuse,
+            # so ask again for the whole document
+            response = fetch({'Cache-Control': 'no-cache'})
+            if response.status_code == 304:
+                raise Exception('Failed to gather {} from Web Service, '
+                                'HTTP status_code: 304'.format(url))
+        if response.status_code == 304 and entry is not None:
+            value = entry[0]
+            with self._lock:
+                self.revalidated += 1
+                self._entries[url] = (value, entry[1], time.monotonic())
+            return value
+        value = response.json()
+        validators = {'etag': response.headers.get('ETag'),
+                      'last_modified': response.headers.get('Last-Modified')}
+        with self._lock:
+            self.misses += 1
+            self._entries[url] = (value, validators, time.monotonic())
+        return value
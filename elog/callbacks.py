@@ -0,0 +1,230 @@
+"""
+Bluesky callbacks that post to the ELog
+"""
+import html
+import logging
+import math
+import numbers
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+
+class RunningStats:
+    """
+    Streaming summary statistics of a scalar
+
+    Uses Welford's algorithm so that the mean and standard deviation are
+    accurate without keeping any of the values.
+    """
+    __slots__ = ('count', 'mean', 'min', 'max', '_m2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.min = math.inf
+        self.max = -math.inf
+        self._m2 = 0.
+
+    def update(self, value):
+        """Add a single value"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def std(self):
+        """Sample standard deviation of the values"""
+        if self.count < 2:
+            return 0.
+        return math.sqrt(self._m2 / (self.count - 1))
+
+
+def _is_scalar(value):
+    return (isinstance(value, numbers.Real)
+            and not isinstance(value, bool)
+            and math.isfinite(value))
+
+
+class RunSummaryCallback:
+    """
+    Post a summary of each Bluesky run to the ELog
+
+    Subscribe an instance to the ``RunEngine``. While the run progresses the
+    callback keeps streaming statistics of every scalar field of every
+    stream; events themselves are never stored, so memory does not grow
+    with the length of the run. When the stop document arrives the summary
+    is posted without blocking the ``RunEngine``, either through the
+    scheduler of the ELog or on a background thread.
+
+    If the ELog has an ``enable_run_posts`` attribute, as
+    :class:`.HutchELog` does, runs are only posted while it is True.
+
+    Usage:
+
+        .. code-block:: python
+
+            el = HutchELog('XPP', enable_run_posts=True)
+            RE.subscribe(RunSummaryCallback(el, tags=['scan']))
+
+    Parameters
+    ----------
+    elog : ELog
+        Client used to post the summaries
+
+    run_key : str, optional
+        Key of the start document holding the DAQ run number, e.g. metadata
+        added with ``RE.md``. The value is posted as ``run``. By default
+        summaries are not associated with a run, as the Bluesky ``scan_id``
+        is unrelated to the DAQ run number
+
+    tags : list, optional
+        Tags to add to every summary
+
+    priority : Priority, optional
+        Priority of the posts if the ELog has a scheduler
+    """
+    def __init__(self, elog, run_key=None, tags=None,
+                 priority=Priority.BULK):
+        self.elog = elog
+        self.run_key = run_key
+        self.tags = tags
+        self.priority = priority
+        self._executor = None
+        self._reset()
+
+    def _reset(self):
+        self._start = None
+        self._streams = dict()
+        self._stats = dict()
+
+    def __call__(self, name, doc):
+        handler = getattr(self, name, None)
+        if handler is not None:
+            handler(doc)
+
+    def start(self, doc):
+        self._reset()
+        self._start = doc
+
+    def descriptor(self, doc):
+        stream = doc.get('name', 'primary')
+        self._streams[doc['uid']] = stream
+        self._stats.setdefault(stream, dict())
+
+    def event(self, doc):
+        stats = self._stats_for(doc['descriptor'])
+        for key, value in doc['data'].items():
+            if _is_scalar(value):
+                if key not in stats:
+                    stats[key] = RunningStats()
+                stats[key].update(value)
+
+    def event_page(self, doc):
+        stats = self._stats_for(doc['descriptor'])
+        for key, values in doc['data'].items():
+            for value in values:
+                if _is_scalar(value):
+                    if key not in stats:
+                        stats[key] = RunningStats()
+                    stats[key].update(value)
+
+    def _stats_for(self, descriptor):
+        stream = self._streams.get(descriptor, 'primary')
+        return self._stats.setdefault(stream, dict())
+
+    def stop(self, doc):
+        start = self._start
+        if start is None:
+            logger.debug("Received a stop document without a start")
+            return
+        title, msg = self.summarize(start, doc)
+        self._reset()
+        if not getattr(self.elog, 'enable_run_posts', True):
+            logger.debug("Run posts are disabled, skipping %s", start['uid'])
+            return
+        run = start.get(self.run_key) if self.run_key else None
+        try:
+            self._post(msg, run=run, tags=self.tags, title=title)
+        except Exception:
+            logger.exception("Unable to post summary of %s", start['uid'])
+
+    def _post(self, msg, **kwargs):
+        """Post without waiting for the web service"""
+        if getattr(self.elog, 'scheduler', None) is not None:
+            futures = self.elog.post(msg, priority=self.priority,
+                                     wait=False, **kwargs)
+            for future in futures.values():
+                future.add_done_callback(self._log_failure)
+            return futures
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='RunSummaryCallback')
+        future = self._executor.submit(self.elog.post, msg, **kwargs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        exc = future.exception()
+        if exc is not None:
+            logger.error("Unable to post run summary: %s", exc)
+
+    def summarize(self, start, stop):
+        """
+        Build the summary of a run
+
+        Parameters
+        ----------
+        start : dict
+            Start document of the run
+
+        stop : dict
+            Stop document of the run
+
+        Returns
+        -------
+        title : str
+
+        msg : str
+            HTML body of the post
+        """
+        esc = html.escape
+        plan = start.get('plan_name', 'run')
+        scan_id = start.get('scan_id')
+        title = f'{plan} {scan_id}' if scan_id is not None else plan
+        duration = stop.get('time', time.time()) - start.get('time', 0)
+        rows = [('Plan', plan),
+                ('Status', stop.get('exit_status')),
+                ('Duration', f'{duration:.1f} s'),
+                ('Events', ', '.join(f'{stream}: {n}' for stream, n
+                                     in stop.get('num_events', {}).items())),
+                ('Motors', ', '.join(start.get('motors', []))),
+                ('Detectors', ', '.join(start.get('detectors', []))),
+                ('UID', start.get('uid'))]
+        if stop.get('reason'):
+            rows.append(('Reason', stop['reason']))
+        parts = ['<table>']
+        parts.extend(f'<tr><th>{esc(name)}</th><td>{esc(str(value))}</td>'
+                     '</tr>' for name, value in rows if value)
+        parts.append('</table>')
+        for stream, stats in self._stats.items():
+            if not stats:
+                continue
+            parts.append(f'<h4>{esc(stream)}</h4><table>'
+                         '<tr><th>Field</th><th>Count</th><th>Mean</th>'
+                         '<th>Std</th><th>Min</th><th>Max</th></tr>')
+            parts.extend(f'<tr><td>{esc(key)}</td><td>{s.count}</td>'
+                         f'<td>{s.mean:.6g}</td><td>{s.std:.6g}</td>'
+                         f'<td>{s.min:.6g}</td><td>{s.max:.6g}</td></tr>'
+                         for key, s in sorted(stats.items()))
+            parts.append('</table>')
+        return title, ''.join(parts)
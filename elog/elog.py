@@ -3,13 +3,22 @@ Front-facing API for PCDS Elog
 """
 import logging
 import os
+import shutil
+import tempfile
+import threading
 from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from configparser import ConfigParser, NoOptionError
 
 from ophyd.status import StatusBase
 
+from . import utils
+from .entry import IncrementalEntry
 from .pswww import PHPWebService
+from .scheduler import Priority
+from .tables import render_html, write_data
 from .utils import facility_name, get_primary_elog, register_elog
+from .watcher import ExperimentWatcher
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +26,62 @@ logger = logging.getLogger(__name__)
 Attachment = namedtuple('Attachment', ('path', 'description'))
 
 
+def _select_logbooks(experiment, facility):
+    """Convert the experiment and facility switches to logbook types"""
+    if experiment and facility:
+        return ['facility', 'experiment']
+    elif experiment:
+        return ['experiment']
+    elif facility:
+        return ['facility']
+    raise ValueError("Must select either facility or experiment")
+
+
+def _status_from_futures(futures):
+    """Create a status that finishes once every future is done"""
+    status = StatusBase()
+    futures = list(futures)
+    if not futures:
+        status.set_finished()
+        return status
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def done(future):
+        exc = future.exception()
+        with lock:
+            if status.done:
+                return
+            remaining[0] -= 1
+            if exc is not None:
+                status.set_exception(exc)
+            elif not remaining[0]:
+                status.set_finished()
+
+    for future in futures:
+        future.add_done_callback(done)
+    return status
+
+
+def _remove_when_done(directory, futures):
+    """Remove a directory once every future is done"""
+    if not futures:
+        shutil.rmtree(directory, ignore_errors=True)
+        return
+    lock = threading.Lock()
+    remaining = [len(futures)]
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            last = not remaining[0]
+        if last:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
 class ELog:
     """
     Basic interface to ELog
@@ -35,15 +100,26 @@ class ELog:
 
     base_url : str, optional
         Point to a different server; perhaps a test server.
+
+    scheduler : PostScheduler, optional
+        Run posts through this scheduler, ordering them by priority. If not
+        supplied, posts are made synchronously in the calling thread.
+
+    pool_size : int, optional
+        Maximum number of connections kept open to the web service
     """
-    def __init__(self, logbooks, user=None, pw=None, base_url=None, dev=False):
+    def __init__(self, logbooks, user=None, pw=None, base_url=None, dev=False,
+                 scheduler=None, pool_size=10):
         self.logbooks = logbooks
+        self.scheduler = scheduler
         self.service = PHPWebService(user=user, pw=pw,
-                                     base_url=base_url, dev=dev
+                                     base_url=base_url, dev=dev,
+                                     pool_size=pool_size
                                      )
 
     def post(self, msg, run=None, tags=None,
-             attachments=None, logbooks=None, title=None):
+             attachments=None, logbooks=None, title=None,
+             priority=Priority.INTERACTIVE, wait=True):
         """
         Post to the logbooks
 
@@ -68,21 +144,172 @@ class ELog:
 
         title : str, optional
             Interprets the message as a HTML message with this as the title
+
+        priority : Priority, optional
+            Priority of the post if the client has a scheduler
+
+        wait : bool, optional
+            If False and the client has a scheduler, return futures of the
+            entry IDs rather than waiting for the posts to be made
+
+        Returns
+        -------
+        entry_ids : dict
+            Mapping of logbook alias to the ID of the new entry
         """
-        logbooks = logbooks or self.logbooks.keys()
-        for alias in logbooks:
-            logger.info('Posting to %s logbook ...', alias)
+        entry_ids = self._post(msg, self._book_ids(logbooks), run=run,
+                               tags=tags, attachments=attachments,
+                               title=title, priority=priority)
+        if self.scheduler is not None and wait:
+            entry_ids = {alias: future.result()
+                         for alias, future in entry_ids.items()}
+        return entry_ids
+
+    def _book_ids(self, logbooks=None):
+        """Map each logbook alias to the logbook ID it currently refers to"""
+        book_ids = dict()
+        for alias in logbooks or list(self.logbooks.keys()):
             # Grab the information from our logbook
             try:
-                book_id = self.logbooks[alias]
+                book_ids[alias] = self.logbooks[alias]
             except KeyError as exc:
                 logger.exception('Invalid logbook name %s', exc)
+        return book_ids
+
+    def _post(self, msg, book_ids, run=None, tags=None, attachments=None,
+              title=None, priority=Priority.INTERACTIVE):
+        """Post to already resolved logbook IDs"""
+        entry_ids = dict()
+        for alias, book_id in book_ids.items():
+            logger.info('Posting to %s logbook ...', alias)
+            # Post the information to selected id
+            if self.scheduler is None:
+                entry_ids[alias] = self.service.post(
+                    msg, book_id, run=run, tags=tags,
+                    attachments=attachments, title=title)
             else:
-                # Post the information to selected id
-                self.service.post(msg, book_id,
-                                  run=run, tags=tags,
-                                  attachments=attachments,
-                                  title=title)
+                entry_ids[alias] = self.scheduler.submit(
+                    self.service.post, msg, book_id, run=run, tags=tags,
+                    attachments=attachments, title=title,
+                    priority=priority)
+        return entry_ids
+
+    def start_entry(self, msg, run=None, tags=None, attachments=None,
+                    logbooks=None, title=None, min_interval=5.0):
+        """
+        Post an entry that will be extended by incremental updates
+
+        The entry is posted immediately and the returned
+        :class:`.IncrementalEntry` adds follow-ups to it, coalescing updates
+        that arrive faster than ``min_interval``. If the client has a
+        scheduler, follow-ups are submitted to it at ``Priority.BULK``.
+
+        Parameters
+        ----------
+        msg : str
+            Desired text of LogBook message
+
+        run : int, optional
+            Associate the entry and its follow-ups with a specific run
+
+        tags : list, optional
+            List of tags to add to the post
+
+        attachments : list, optional
+            These can either be entered as the path to each attachment or a
+            tuple of a path and description
+
+        logbooks : list, optional
+            Only post to a subset of the logbooks known by the client. If this
+            is left as None, all logbooks will be included.
+
+        title : str, optional
+            Interprets the message as a HTML message with this as the title
+
+        min_interval : float, optional
+            Minimum time in seconds between consecutive follow-ups
+
+        Returns
+        -------
+        entry : IncrementalEntry
+        """
+        # Resolve the logbooks once, as the experiment may be swapped by the
+        # watcher before the follow-ups are posted
+        book_ids = self._book_ids(logbooks)
+        entry_ids = self._post(msg, book_ids, run=run, tags=tags,
+                               attachments=attachments, title=title)
+        if self.scheduler is not None:
+            entry_ids = {alias: future.result()
+                         for alias, future in entry_ids.items()}
+        return IncrementalEntry(self.service,
+                                {book_ids[alias]: entry_id
+                                 for alias, entry_id in entry_ids.items()},
+                                run=run, min_interval=min_interval,
+                                scheduler=self.scheduler)
+
+    def post_table(self, data, title, msg=None, attachments=None,
+                   max_bytes=65536, precision=6, fmt='csv', **kwargs):
+        """
+        Post tabular data as an HTML table
+
+        The table is rendered with :func:`.render_html`. If it does not fit
+        in ``max_bytes``, only its first and last rows are shown along with
+        summary statistics, and the complete data is attached as a
+        compressed file.
+
+        Parameters
+        ----------
+        data : DataFrame, Series, array or dict
+            Data to post
+
+        title : str
+            Title of the post
+
+        msg : str, optional
+            HTML placed before the table
+
+        attachments : list, optional
+            These can either be entered as the path to each attachment or a
+            tuple of a path and description
+
+        max_bytes : int, optional
+            Approximate size limit of the table
+
+        precision : int, optional
+            Significant digits of floating point values
+
+        fmt : {'csv', 'parquet'}, optional
+            Format of the complete data when it is attached
+
+        kwargs :
+            Passed to :meth:`.post`
+
+        Returns
+        -------
+        entry_ids : dict
+            Mapping of logbook alias to the ID of the new entry
+        """
+        rendered = render_html(data, max_bytes=max_bytes, precision=precision)
+        attachments = list(attachments or [])
+        directory = None
+        if rendered.shown < rendered.rows:
+            directory = tempfile.mkdtemp(prefix='elog-')
+            attachments.append(write_data(data, os.path.join(directory,
+                                                             'data'),
+                                          fmt=fmt))
+        try:
+            entry_ids = self.post((msg or '') + rendered.html, title=title,
+                                  attachments=attachments, **kwargs)
+        except BaseException:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+            raise
+        if directory is not None:
+            # Queued posts open their attachments when they are made
+            _remove_when_done(directory,
+                              [entry_id for entry_id in entry_ids.values()
+                               if isinstance(entry_id, Future)])
+        return entry_ids
 
 
 class HutchELog(ELog):
@@ -126,16 +353,27 @@ class HutchELog(ELog):
         from_registry class method is used. If False, this will not be.
         If omitted, this will default to True if there is no primary elog
         or False if there already is one.
+
+    watch_experiment : bool, optional
+        If True, follow experiment changeovers in the background. See
+        :meth:`.start_experiment_watcher`
+
+    scheduler : PostScheduler, optional
+        Run posts through this scheduler, ordering them by priority. If not
+        supplied, posts are made synchronously in the calling thread.
     """
 
     def __init__(self, instrument, station=None, user=None, pw=None,
                  base_url=None, primary=None, dev=False,
-                 enable_run_posts=False):
+                 enable_run_posts=False, watch_experiment=False,
+                 scheduler=None):
         self.instrument = instrument
         self.station = station
+        self.watcher = None
         # Load an empty service
         logger.debug("Loading logbooks for %s", instrument)
-        super().__init__({}, user=user, pw=pw, base_url=base_url, dev=dev)
+        super().__init__({}, user=user, pw=pw, base_url=base_url, dev=dev,
+                         scheduler=scheduler)
         # Load the facilities logbook
         f_id = facility_name(instrument)
         self.logbooks['facility'] = self.service.get_facilities_logbook(f_id)
@@ -147,9 +385,45 @@ class HutchELog(ELog):
 
         # Switch for ELog posting callback in pcdshub/nabs
         self.enable_run_posts = enable_run_posts
+        if watch_experiment:
+            self.start_experiment_watcher()
+
+    def start_experiment_watcher(self, interval=60.0, callback=None):
+        """
+        Follow experiment changeovers in the background
+
+        The active experiment is polled with conditional requests every
+        ``interval`` seconds and ``logbooks['experiment']`` is swapped when it
+        changes. Posting is never blocked by the watcher.
+
+        Parameters
+        ----------
+        interval : float, optional
+            Time in seconds between polls
+
+        callback : callable, optional
+            Called as ``callback(old=old_id, new=new_id)`` when the
+            experiment changes
+
+        Returns
+        -------
+        watcher : ExperimentWatcher
+        """
+        self.stop_experiment_watcher()
+        self.watcher = ExperimentWatcher(self, interval=interval,
+                                         callback=callback)
+        self.watcher.start()
+        return self.watcher
+
+    def stop_experiment_watcher(self):
+        """Stop following experiment changeovers"""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
 
     def post(self, msg, run=None, tags=None, attachments=None,
-             experiment=True, facility=False, title=None):
+             experiment=True, facility=False, title=None,
+             priority=Priority.INTERACTIVE, wait=True):
         """
         Post to ELog
 
@@ -176,20 +450,66 @@ class HutchELog(ELog):
 
         title : str, optional
             Interprets the message as a HTML message with this as the title
+
+        priority : Priority, optional
+            Priority of the post if the client has a scheduler
+
+        wait : bool, optional
+            If False and the client has a scheduler, return futures of the
+            entry IDs rather than waiting for the posts to be made
+
+        Returns
+        -------
+        entry_ids : dict
+            Mapping of logbook alias to the ID of the new entry
         """
-        books = list()
-        # Select our logbooks
-        if experiment and facility:
-            pass
-        elif experiment:
-            books.append('experiment')
-        elif facility:
-            books.append('facility')
-        else:
-            raise ValueError("Must select either facility or experiment")
+        books = _select_logbooks(experiment, facility)
         # Post
-        super().post(msg, run=run, tags=tags,
-                     attachments=attachments, logbooks=books, title=title)
+        return super().post(msg, run=run, tags=tags, attachments=attachments,
+                            logbooks=books, title=title, priority=priority,
+                            wait=wait)
+
+    def start_entry(self, msg, run=None, tags=None, attachments=None,
+                    experiment=True, facility=False, title=None,
+                    min_interval=5.0):
+        """
+        Post an entry that will be extended by incremental updates
+
+        Parameters
+        ----------
+        msg: str
+            Body of message
+
+        run : int, optional
+            Associate the entry and its follow-ups with a specific run
+
+        tags : list, optional
+            List of tags to add to the post
+
+        attachments : list, optional
+            These can either be entered as the path to each attachment or a
+            tuple of a path and description
+
+        facility : bool, optional
+            Post to the facility logbook
+
+        experiment: bool, optional
+            Post to the experimental logbook
+
+        title : str, optional
+            Interprets the message as a HTML message with this as the title
+
+        min_interval : float, optional
+            Minimum time in seconds between consecutive follow-ups
+
+        Returns
+        -------
+        entry : IncrementalEntry
+        """
+        books = _select_logbooks(experiment, facility)
+        return super().start_entry(msg, run=run, tags=tags,
+                                   attachments=attachments, logbooks=books,
+                                   title=title, min_interval=min_interval)
 
     @classmethod
     def from_conf(cls, *args, **kwargs):
@@ -242,11 +562,193 @@ class HutchELog(ELog):
         """
         return get_primary_elog()
 
-    def set(self, *args, **kwargs):
-        """ Pass through method to post for Bluesky API compatibility """
-        self.post(*args, **kwargs)
+    def set(self, *args, priority=Priority.BULK, **kwargs):
+        """
+        Pass through method to post for Bluesky API compatibility
+
+        If the client has a scheduler, the post is queued with ``priority``
+        and the returned status finishes once the post has been made.
+        """
+        if self.scheduler is not None:
+            futures = self.post(*args, priority=priority, wait=False,
+                                **kwargs)
+            return _status_from_futures(futures.values())
+
+        self.post(*args, priority=priority, **kwargs)
 
         # set message requrires a status object to be returned.
         # another message could possibly be used, but this seemed simplest
         status = StatusBase(done=True, success=True)
         return status
+
+
+class FacilityELog(ELog):
+    """
+    ELog client for many LCLS instruments at once
+
+    The facility and experiment logbooks of every instrument are resolved
+    concurrently when the client is created, so startup costs roughly one
+    round trip to the web service regardless of the number of instruments.
+    All instruments share a single connection pool.
+
+    Logbooks are stored under the alias ``<instrument>:<type>`` where the
+    type is either ``facility`` or ``experiment``. Instruments without an
+    active experiment only have a facility logbook.
+
+    Usage:
+
+        .. code-block:: python
+
+            el = FacilityELog()
+            el.post('Beam is down', facility=True, experiment=False)
+            el.post('Sample change complete', instruments=['XPP', 'XCS'])
+
+    Parameters
+    ----------
+    instruments : list, optional
+        Three letter acronyms of the instruments, in any case. Defaults to
+        every instrument in ``elog.utils.instruments``
+
+    user: str, optional
+        Username for ws-auth authentication
+
+    pw : str, optional
+        Password, if this is left blank and a username is supplied the password
+        will be requested via prompt
+
+    base_url : str, optional
+        Point to a different server; perhaps a test server.
+
+    max_workers : int, optional
+        Maximum number of concurrent requests while resolving logbooks.
+        Defaults to one per request, up to ``pool_size``.
+
+    scheduler : PostScheduler, optional
+        Run posts through this scheduler, ordering them by priority. If not
+        supplied, posts are made synchronously in the calling thread.
+
+    pool_size : int, optional
+        Maximum number of connections kept open to the web service.
+        Defaults to one per logbook lookup
+    """
+    def __init__(self, instruments=None, user=None, pw=None, base_url=None,
+                 dev=False, max_workers=None, scheduler=None, pool_size=None):
+        self.instruments = [instrument.upper() for instrument in
+                            instruments or utils.instruments]
+        self.pool_size = pool_size or 2 * len(self.instruments)
+        super().__init__({}, user=user, pw=pw, base_url=base_url, dev=dev,
+                         scheduler=scheduler, pool_size=self.pool_size)
+        self.resolve_logbooks(max_workers=max_workers)
+
+    def resolve_logbooks(self, max_workers=None):
+        """
+        Look up the facility and experiment logbooks of every instrument
+
+        Lookups that fail are logged and the corresponding alias is left
+        out of ``logbooks``.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Maximum number of concurrent requests. Defaults to one per
+            request, up to the size of the connection pool.
+        """
+        lookups = dict()
+        for instrument in self.instruments:
+            lookups[f'{instrument}:facility'] = (
+                self.service.get_facilities_logbook,
+                (facility_name(instrument),))
+            lookups[f'{instrument}:experiment'] = (
+                self.service.get_experiment_logbook, (instrument,))
+        logger.debug("Resolving %s logbooks", len(lookups))
+        # More workers than connections would only open and discard extras
+        max_workers = min(max_workers or len(lookups), self.pool_size)
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix='FacilityELog') as pool:
+            futures = {alias: pool.submit(func, *args)
+                       for alias, (func, args) in lookups.items()}
+        logbooks = dict()
+        for alias, future in futures.items():
+            try:
+                logbooks[alias] = future.result()
+            except Exception as exc:
+                # Expected for instruments without an active experiment
+                logger.warning("Unable to find the %s logbook: %s",
+                               alias, exc)
+        self.logbooks = logbooks
+        return logbooks
+
+    def post(self, msg, run=None, tags=None, attachments=None,
+             instruments=None, experiment=True, facility=False, title=None,
+             priority=Priority.INTERACTIVE, wait=True):
+        """
+        Post to the logbooks of several instruments
+
+        Parameters
+        ----------
+        msg: str
+            Body of message
+
+        run : int, optional
+            Associate the post with a specific run
+
+        tags : list, optional
+            List of tags to add to the post
+
+        attachments : list, optional
+            These can either be entered as the path to each attachment or a
+            tuple of a path and description
+
+        instruments : list, optional
+            Only post to a subset of the instruments. If this is left as None,
+            all instruments with the selected logbooks will be included.
+
+        facility : bool, optional
+            Post to the facility logbooks
+
+        experiment: bool, optional
+            Post to the experimental logbooks
+
+        title : str, optional
+            Interprets the message as a HTML message with this as the title
+
+        priority : Priority, optional
+            Priority of the post if the client has a scheduler
+
+        wait : bool, optional
+            If False and the client has a scheduler, return futures of the
+            entry IDs rather than waiting for the posts to be made
+
+        Returns
+        -------
+        entry_ids : dict
+            Mapping of logbook alias to the ID of the new entry
+
+        Raises
+        ------
+        ValueError
+            If a requested instrument has no selected logbook
+        """
+        books = _select_logbooks(experiment, facility)
+        if instruments is None:
+            aliases = [f'{instrument}:{book}'
+                       for instrument in self.instruments for book in books]
+            missing = [alias for alias in aliases
+                       if alias not in self.logbooks]
+            if missing:
+                logger.warning("Skipping logbooks that were not found: %s",
+                               ', '.join(missing))
+        else:
+            aliases = [f'{instrument.upper()}:{book}'
+                       for instrument in instruments for book in books]
+            missing = [alias for alias in aliases
+                       if alias not in self.logbooks]
+            if missing:
+                raise ValueError("No logbook found for {}"
+                                 "".format(', '.join(missing)))
+        aliases = [alias for alias in aliases if alias in self.logbooks]
+        if not aliases:
+            raise ValueError("No logbook found for any instrument")
+        return super().post(msg, run=run, tags=tags, attachments=attachments,
+                            logbooks=aliases, title=title, priority=priority,
+                            wait=wait)
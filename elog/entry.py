@@ -0,0 +1,208 @@
+"""
+Incrementally updated ELog entries
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from .scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalEntry:
+    """
+    An ELog entry that is created once and then extended with follow-ups
+
+    Long running processes, e.g. scans, often want to report progress as they
+    go. Rather than posting a brand new entry for every update, the updates
+    are buffered and posted as follow-ups to a single parent entry. Updates
+    that arrive within ``min_interval`` of the previous follow-up are
+    coalesced into a single post.
+
+    This object is usually created by :meth:`.ELog.start_entry` rather than
+    directly.
+
+    Usage:
+
+        .. code-block:: python
+
+            with el.start_entry('Starting scan', min_interval=30) as entry:
+                for step in scan:
+                    entry.update(f'Finished step {step}')
+                entry.update('Done', attachments=['scan.png'])
+
+    Parameters
+    ----------
+    service : PHPWebService
+        Service used to post the follow-ups
+
+    entry_ids : dict
+        Mapping of logbook ID to the ID of the parent entry in that logbook
+
+    run : int, optional
+        Associate the follow-ups with a specific run
+
+    min_interval : float, optional
+        Minimum time in seconds between consecutive follow-ups
+
+    scheduler : PostScheduler, optional
+        Submit the follow-ups to this scheduler at ``Priority.BULK`` rather
+        than posting them in the calling thread. Each follow-up is submitted
+        once the previous one has finished, so they stay in order without
+        blocking :meth:`.update`.
+    """
+    def __init__(self, service, entry_ids, run=None, min_interval=5.0,
+                 scheduler=None):
+        self.service = service
+        self.entry_ids = dict(entry_ids)
+        self.run = run
+        self.min_interval = min_interval
+        self.scheduler = scheduler
+        self.closed = False
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._lock = threading.Lock()
+        # Only one thread posts at a time so follow-ups stay in order
+        self._post_lock = threading.Lock()
+        # Follow-ups waiting for the previous scheduled one to finish
+        self._chain = threading.Condition(threading.RLock())
+        self._queue = deque()
+        self._running = None
+        self._errors = []
+        self._reset()
+
+    def _reset(self):
+        self._messages = []
+        self._tags = []
+        self._attachments = []
+
+    @property
+    def pending(self):
+        """Whether there are updates that have not been posted yet"""
+        return bool(self._messages or self._tags or self._attachments)
+
+    def update(self, msg=None, tags=None, attachments=None):
+        """
+        Add an update to the entry
+
+        The update is posted immediately if at least ``min_interval`` seconds
+        have passed since the last follow-up. Otherwise it is combined with
+        any other pending updates and posted once the interval has elapsed.
+
+        Parameters
+        ----------
+        msg : str, optional
+            Text to append to the entry
+
+        tags : list, optional
+            Tags to add to the entry
+
+        attachments : list, optional
+            These can either be entered as the path to each attachment or a
+            tuple of a path and description
+        """
+        if self.closed:
+            raise RuntimeError("Unable to update an entry that is closed")
+        with self._lock:
+            if msg:
+                self._messages.append(msg)
+            if tags:
+                if not isinstance(tags, list):
+                    tags = [tags]
+                self._tags.extend(tag for tag in tags
+                                  if tag not in self._tags)
+            if attachments:
+                self._attachments.extend(attachments)
+            wait = self._last_flush + self.min_interval - time.monotonic()
+            if wait > 0:
+                # Schedule a single flush at the end of the interval
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self._flush_scheduled)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def _flush_scheduled(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to post follow-up to %s",
+                             list(self.entry_ids.values()))
+
+    def flush(self):
+        """Post all pending updates now"""
+        with self._post_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self.pending:
+                    return
+                msg = '\n'.join(self._messages)
+                tags = list(self._tags)
+                attachments = list(self._attachments)
+                self._reset()
+                self._last_flush = time.monotonic()
+            if self.scheduler is None:
+                self._post_followups(msg, tags, attachments)
+            else:
+                with self._chain:
+                    self._queue.append((msg, tags, attachments))
+                    if self._running is None:
+                        self._submit_next()
+
+    def _post_followups(self, msg, tags, attachments):
+        for logbook_id, entry_id in self.entry_ids.items():
+            logger.debug("Posting follow-up to %s in %s",
+                         entry_id, logbook_id)
+            self.service.post(msg, logbook_id, run=self.run, tags=tags,
+                              attachments=attachments, parent=entry_id)
+
+    def _submit_next(self):
+        """Submit the next queued follow-up, must hold the chain"""
+        if not self._queue:
+            self._running = None
+            self._chain.notify_all()
+            return
+        msg, tags, attachments = self._queue.popleft()
+        try:
+            self._running = self.scheduler.submit(
+                self._post_followups, msg, tags, attachments,
+                priority=Priority.BULK)
+        except Exception as exc:
+            logger.error("Failed to submit follow-ups to %s: %s",
+                         list(self.entry_ids.values()), exc)
+            self._errors.append(exc)
+            self._queue.clear()
+            self._running = None
+            self._chain.notify_all()
+        else:
+            self._running.add_done_callback(self._followup_done)
+
+    def _followup_done(self, future):
+        with self._chain:
+            if future.exception() is not None:
+                logger.error("Failed to post follow-up to %s: %s",
+                             list(self.entry_ids.values()),
+                             future.exception())
+                self._errors.append(future.exception())
+            self._submit_next()
+
+    def close(self):
+        """Post pending updates, wait for them and refuse further updates"""
+        self.flush()
+        self.closed = True
+        with self._chain:
+            self._chain.wait_for(lambda: self._running is None)
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,324 @@
+"""
+Bulk export of logbooks for archiving and offline analysis
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class _CheckpointMismatch(Exception):
+    """The logbook no longer matches the checkpoint of an export"""
+
+
+class IncompleteExport(Exception):
+    """Attachments failed to download, rerun the export to retry them"""
+
+
+class _JSONLWriter:
+    """Write entries as one JSON document per line"""
+    def __init__(self, path, state=None):
+        self.path = path
+        self.offset = (state or {}).get('offset', 0)
+        if self.offset:
+            # Drop anything written after the last checkpoint
+            self._file = open(path, 'r+b')
+            self._file.truncate(self.offset)
+            self._file.seek(self.offset)
+        else:
+            self._file = open(path, 'wb')
+
+    def write(self, entries):
+        for entry in entries:
+            self._file.write(json.dumps(entry).encode() + b'\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.offset = self._file.tell()
+
+    def state(self):
+        return {'offset': self.offset}
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    """Write entries as a directory of Parquet files, one per batch"""
+    columns = ('_id', 'insert_time', 'relevance_time', 'author', 'title',
+               'content', 'content_type', 'parent', 'root')
+
+    def __init__(self, path, state=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise ImportError("Exporting to Parquet requires pyarrow") from exc
+        self._pa, self._pq = pa, pq
+        self.schema = pa.schema(
+            [(column, pa.string()) for column in self.columns]
+            + [('run_num', pa.int64()),
+               ('tags', pa.list_(pa.string())),
+               ('attachments', pa.string()),
+               ('entry', pa.string())])
+        self.path = path
+        self.parts = (state or {}).get('parts', 0)
+        os.makedirs(path, exist_ok=True)
+        # Drop anything written after the last checkpoint
+        for name in os.listdir(path):
+            if name.startswith('part-') and self._index(name) >= self.parts:
+                os.remove(os.path.join(path, name))
+
+    @staticmethod
+    def _index(name):
+        try:
+            return int(name.split('-')[1].split('.')[0])
+        except (IndexError, ValueError):
+            return -1
+
+    def _row(self, entry):
+        row = {column: (None if entry.get(column) is None
+                        else str(entry[column]))
+               for column in self.columns}
+        run = entry.get('run_num')
+        row['run_num'] = int(run) if run not in (None, '') else None
+        row['tags'] = [str(tag) for tag in entry.get('tags') or []]
+        row['attachments'] = json.dumps(entry.get('attachments') or [])
+        row['entry'] = json.dumps(entry)
+        return row
+
+    def write(self, entries):
+        table = self._pa.Table.from_pylist([self._row(entry)
+                                            for entry in entries],
+                                           schema=self.schema)
+        filename = os.path.join(self.path, f'part-{self.parts:05}.parquet')
+        self._pq.write_table(table, filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+        self.parts += 1
+
+    def state(self):
+        return {'parts': self.parts}
+
+    def close(self):
+        pass
+
+
+_writers = {'jsonl': _JSONLWriter, 'parquet': _ParquetWriter}
+
+
+class LogbookExporter:
+    """
+    Export every entry of a logbook to disk
+
+    Entries are streamed from the web service and written in batches, so
+    memory use is bounded by ``batch_size`` rather than the size of the
+    logbook. After each batch a checkpoint is saved next to the output. If
+    the export is interrupted, running it again resumes after the last
+    checkpoint; the checkpoint is removed once the export completes.
+
+    Attachments that fail to download are recorded in the checkpoint and
+    :class:`IncompleteExport` is raised at the end of the export. Running it
+    again retries them.
+
+    Attachments are optionally downloaded alongside the entries, on a pool
+    of ``max_workers`` threads with a bounded number of downloads queued at
+    once. They are saved as ``<attachments>/<entry_id>/<attachment_id>_<name>``
+    and files that already exist are not downloaded again.
+
+    Usage:
+
+        .. code-block:: python
+
+            exporter = LogbookExporter(service, 'xppx12345',
+                                       'xppx12345.jsonl',
+                                       attachments='xppx12345_attachments')
+            exporter.run()
+
+    Parameters
+    ----------
+    service : PHPWebService
+        Service used to read the logbook
+
+    logbook_id : str
+        This is the name/id of the logbook; typically the experiment name.
+
+    path : str
+        Output file for JSONL, or output directory for Parquet
+
+    fmt : {'jsonl', 'parquet'}, optional
+        Output format. By default this is taken from the extension of
+        ``path``, falling back to JSONL
+
+    attachments : str, optional
+        Directory to download attachments into. If not supplied,
+        attachments are not downloaded
+
+    max_workers : int, optional
+        Number of concurrent attachment downloads
+
+    batch_size : int, optional
+        Number of entries written between checkpoints
+    """
+    def __init__(self, service, logbook_id, path, fmt=None, attachments=None,
+                 max_workers=4, batch_size=1000):
+        self.service = service
+        self.logbook_id = logbook_id
+        self.path = os.path.normpath(path)
+        if fmt is None:
+            fmt = 'parquet' if self.path.endswith('.parquet') else 'jsonl'
+        if fmt not in _writers:
+            raise ValueError(f"Unknown export format {fmt!r}, choose from "
+                             f"{', '.join(_writers)}")
+        self.fmt = fmt
+        self.attachments = attachments
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.checkpoint_path = self.path + '.checkpoint'
+        self.failed = list()
+
+    def load_checkpoint(self):
+        """Return the saved checkpoint of this export, if any"""
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        if (checkpoint.get('logbook') != self.logbook_id
+                or checkpoint.get('format') != self.fmt):
+            logger.warning("Ignoring checkpoint %s of a different export",
+                           self.checkpoint_path)
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, count, last_id, writer):
+        checkpoint = {'logbook': self.logbook_id, 'format': self.fmt,
+                      'entries': count, 'last_id': last_id,
+                      'failed': self.failed, **writer.state()}
+        with open(self.checkpoint_path + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def run(self):
+        """
+        Export the logbook, resuming from a checkpoint if there is one
+
+        Returns
+        -------
+        count : int
+            Total number of entries in the export
+
+        Raises
+        ------
+        IncompleteExport
+            If any attachment failed to download. The checkpoint is kept so
+            that running the export again retries them.
+        """
+        checkpoint = self.load_checkpoint()
+        while True:
+            try:
+                count = self._export(checkpoint)
+            except _CheckpointMismatch as exc:
+                logger.warning("%s, restarting the export", exc)
+                checkpoint = None
+            else:
+                break
+        if self.failed:
+            raise IncompleteExport(
+                f"Failed to download {len(self.failed)} attachments of "
+                f"{self.logbook_id}, run the export again to retry them")
+        os.remove(self.checkpoint_path)
+        return count
+
+    def _export(self, checkpoint):
+        checkpoint = checkpoint or {}
+        skip = checkpoint.get('entries', 0)
+        if skip:
+            logger.info("Resuming export of %s after %s entries",
+                        self.logbook_id, skip)
+        writer = _writers[self.fmt](self.path, state=checkpoint)
+        count, last_id = skip, checkpoint.get('last_id')
+        retry = checkpoint.get('failed', [])
+        self.failed = list()
+        batch = list()
+        # Bound the number of queued downloads to keep memory constant
+        slots = threading.BoundedSemaphore(2 * self.max_workers)
+        pending = dict()
+
+        def download(entry_id, attachment):
+            slots.acquire()
+            future = pool.submit(self._download, entry_id, attachment)
+            future.add_done_callback(lambda _: slots.release())
+            pending[future] = [entry_id, attachment]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers,
+                                    thread_name_prefix='LogbookExporter'
+                                    ) as pool:
+                if retry:
+                    logger.info("Retrying %s failed attachments", len(retry))
+                for entry_id, attachment in retry:
+                    download(entry_id, attachment)
+                seen = 0
+                for entry in self.service.iter_entries(self.logbook_id):
+                    seen += 1
+                    if seen <= skip:
+                        if seen == skip and entry['_id'] != last_id:
+                            raise _CheckpointMismatch(
+                                f"Entries of {self.logbook_id} changed "
+                                "since the checkpoint")
+                        continue
+                    batch.append(entry)
+                    for attachment in (entry.get('attachments') or []
+                                       if self.attachments else []):
+                        download(entry['_id'], attachment)
+                    if len(batch) >= self.batch_size:
+                        count, last_id = self._write(writer, batch, pending,
+                                                     count, last_id)
+                        batch = list()
+                if seen < skip:
+                    raise _CheckpointMismatch(
+                        f"{self.logbook_id} has fewer entries than the "
+                        "checkpoint")
+                count, last_id = self._write(writer, batch, pending, count,
+                                             last_id)
+        finally:
+            writer.close()
+        logger.info("Exported %s entries of %s to %s", count,
+                    self.logbook_id, self.path)
+        return count
+
+    def _write(self, writer, batch, pending, count, last_id):
+        """Write a batch and checkpoint once its attachments are saved"""
+        if batch:
+            writer.write(batch)
+            count += len(batch)
+            last_id = batch[-1]['_id']
+        for future in wait(pending).done:
+            if future.exception() is not None:
+                self.failed.append(pending[future])
+        pending.clear()
+        self._save_checkpoint(count, last_id, writer)
+        logger.debug("Exported %s entries", count)
+        return count, last_id
+
+    def _download(self, entry_id, attachment):
+        """Save a single attachment, skipping it if it already exists"""
+        name = os.path.basename(str(attachment.get('name', '')))
+        directory = os.path.join(self.attachments, str(entry_id))
+        filename = os.path.join(directory, f"{attachment['_id']}_{name}")
+        if os.path.exists(filename):
+            return filename
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(filename + '.part', 'wb') as f:
+                for chunk in self.service.iter_attachment(
+                        self.logbook_id, entry_id, attachment['_id']):
+                    f.write(chunk)
+            os.replace(filename + '.part', filename)
+        except Exception:
+            logger.exception("Failed to download %s of entry %s",
+                             attachment['_id'], entry_id)
+            raise
+        return filename
@@ -0,0 +1,292 @@
+"""
+Local stand-in for the pswww logbook web service
+
+This implements just enough of the logbook web service used by
+:class:`.PHPWebService` to exercise the client in tests and benchmarks
+without network access to SLAC. The logic lives in :class:`MockLogbook`,
+which works on plain request tuples, and :class:`MockLogbookServer` serves it
+over HTTP on localhost.
+"""
+import email.parser
+import email.policy
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+_route = re.compile(r'.*/lgbk/(?:(?P<logbook>[^/]+)/)?ws/(?P<endpoint>\w+)$')
+
+
+def parse_form(content_type, body):
+    """
+    Parse an urlencoded or multipart form
+
+    Parameters
+    ----------
+    content_type : str
+        Value of the Content-Type header
+
+    body : bytes
+        Body of the request
+
+    Returns
+    -------
+    fields : dict
+        Mapping of field name to value
+
+    files : list
+        ``(field, filename, content)`` for each uploaded file
+    """
+    fields, files = dict(), list()
+    if content_type.startswith('multipart/form-data'):
+        header = f'Content-Type: {content_type}\r\n\r\n'.encode()
+        message = email.parser.BytesParser(
+            policy=email.policy.HTTP).parsebytes(header + body)
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            content = part.get_payload(decode=True)
+            filename = part.get_filename()
+            if filename is None:
+                fields[name] = content.decode()
+            else:
+                files.append((name, filename, content))
+    elif body:
+        fields = {key: values[-1]
+                  for key, values in parse_qs(body.decode()).items()}
+    return fields, files
+
+
+class MockLogbook:
+    """
+    In-memory logbook web service
+
+    Parameters
+    ----------
+    experiments : dict, optional
+        Mapping of instrument name to the name of its active experiment.
+        Entries, attachments and runs are stored in the ``entries``,
+        ``attachments`` and ``runs`` dictionaries, which tests may also fill
+        in directly
+
+    delay : float, optional
+        Time in seconds each request takes to be served
+
+    max_concurrency : int, optional
+        Maximum number of requests served at once. Further requests wait for
+        a free slot, as they would on a saturated server.
+    """
+    def __init__(self, experiments=None, delay=0., max_concurrency=None):
+        self.experiments = dict(experiments or {})
+        self.entries = dict()
+        self.attachments = dict()
+        self.runs = dict()
+        self.delay = delay
+        self.requests = list()
+        self._lock = threading.Lock()
+        self._slots = (threading.BoundedSemaphore(max_concurrency)
+                       if max_concurrency else None)
+
+    def handle(self, method, url, headers, body=b''):
+        """
+        Serve a single request
+
+        Parameters
+        ----------
+        method : str
+            HTTP method
+
+        url : str
+            Requested URL, only the path and query are used
+
+        headers : dict
+            Request headers
+
+        body : bytes, optional
+            Request body
+
+        Returns
+        -------
+        status : int
+
+        headers : dict
+
+        body : bytes
+        """
+        parsed = urlparse(url)
+        query = {key: values[-1]
+                 for key, values in parse_qs(parsed.query).items()}
+        headers = {key.lower(): value for key, value in headers.items()}
+        with self._lock:
+            self.requests.append((method, parsed.path))
+        match = _route.match(parsed.path)
+        if match is None:
+            return self._json(404, {'success': False,
+                                    'error_msg': 'Unknown endpoint'})
+        handler = getattr(self, f"_{method.lower()}_{match['endpoint']}",
+                          None)
+        if handler is None:
+            return self._json(404, {'success': False,
+                                    'error_msg': 'Unknown endpoint'})
+        if self._slots:
+            self._slots.acquire()
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            status, response_headers, content = handler(
+                match['logbook'], query, headers, body)
+        finally:
+            if self._slots:
+                self._slots.release()
+        # Every successful GET can be revalidated with its ETag
+        if method == 'GET' and status == 200:
+            etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+            response_headers['ETag'] = etag
+            if headers.get('if-none-match') == etag:
+                return 304, {'ETag': etag}, b''
+        return status, response_headers, content
+
+    @staticmethod
+    def _json(status, value):
+        return (status, {'Content-Type': 'application/json'},
+                json.dumps(value).encode())
+
+    def _get_info(self, logbook, query, headers, body):
+        return self._json(200, {'success': True, 'value': {'_id': logbook}})
+
+    def _get_activeexperiment_for_instrument_station(self, logbook, query,
+                                                     headers, body):
+        name = self.experiments.get(query.get('instrument_name'))
+        if name is None:
+            return self._json(200, {'success': True, 'value': None})
+        return self._json(200, {'success': True, 'value': {'name': name}})
+
+    def _post_new_elog_entry(self, logbook, query, headers, body):
+        fields, files = parse_form(headers.get('content-type', ''), body)
+        if 'log_text' not in fields:
+            return self._json(200, {'success': False,
+                                    'error_msg': 'Missing log_text'})
+        entry = {'_id': uuid.uuid4().hex,
+                 'insert_time': time.time(),
+                 'content': fields['log_text'],
+                 'title': fields.get('log_title'),
+                 'tags': fields.get('log_tags', '').split(),
+                 'run_num': fields.get('run_num'),
+                 'parent': fields.get('parent'),
+                 'attachments': list()}
+        with self._lock:
+            for (_, filename, content) in files:
+                attachment_id = uuid.uuid4().hex
+                self.attachments[attachment_id] = content
+                entry['attachments'].append({'_id': attachment_id,
+                                             'name': filename,
+                                             'size': len(content)})
+            self.entries.setdefault(logbook, list()).append(entry)
+        return self._json(200, {'success': True, 'value': entry})
+
+    def _get_elog(self, logbook, query, headers, body):
+        return self._json(200, {'success': True,
+                                'value': self.entries.get(logbook, [])})
+
+    def _get_runs(self, logbook, query, headers, body):
+        return self._json(200, {'success': True,
+                                'value': self.runs.get(logbook, [])})
+
+    def _get_attachment(self, logbook, query, headers, body):
+        content = self.attachments.get(query.get('attachment_id'))
+        if content is None:
+            return 404, {}, b''
+        return 200, {'Content-Type': 'application/octet-stream'}, content
+
+
+class MockLogbookServer:
+    """
+    Serve a :class:`MockLogbook` over HTTP on localhost
+
+    Usage:
+
+        .. code-block:: python
+
+            with MockLogbookServer(MockLogbook(delay=0.1)) as server:
+                service = PHPWebService(user='user', pw='pw',
+                                        base_url=server.url)
+
+    Parameters
+    ----------
+    logbook : MockLogbook, optional
+        Logbook to serve. A new one is created if not supplied
+
+    host : str, optional
+        Interface to bind to
+
+    port : int, optional
+        Port to bind to. By default a free port is chosen
+    """
+    def __init__(self, logbook=None, host='127.0.0.1', port=0):
+        self.logbook = logbook or MockLogbook()
+        self._server = ThreadingHTTPServer((host, port),
+                                           self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL of the server"""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _make_handler(self):
+        logbook = self.logbook
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send each response in one write without waiting for ACKs
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                status, headers, content = logbook.handle(
+                    self.command, self.path, dict(self.headers), body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = _serve
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def start(self):
+        """Start serving in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True,
+                                        name='MockLogbookServer')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,18 +1,153 @@
 """
 Interface for PHP based ELog web service
 """
+import codecs
+import datetime
+import email.utils
 import getpass
+import json
 import logging
 import mimetypes
 import os
+import re
 from urllib.parse import urlparse
 
-import requests
 from krtc import KerberosTicket
-from requests.auth import HTTPBasicAuth
+
+from .cache import MetadataCache
+from .transport import RequestsTransport
 
 logger = logging.getLogger(__name__)
 
+_whitespace = re.compile(r'[\s,]*')
+_space = re.compile(r'\s*')
+
+
+def _iter_json_array(chunks, key='value'):
+    """
+    Decode the elements of a JSON array as the document is received
+
+    Only the array stored under ``key`` of the top-level object is decoded.
+    At most one element is held in memory at a time, along with the part of
+    the document that has not been decoded yet.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        The document in pieces, e.g. ``Response.iter_content``
+
+    key : str, optional
+        Key of the array in the top-level object
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    start = re.compile(r'"{}"\s*:\s*\['.format(re.escape(key)))
+    chunks = iter(chunks)
+    buffer = ''
+    head = ''
+    # Find the start of the array
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        match = start.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        head += buffer[:-len(key) - 8]
+        buffer = buffer[-len(key) - 8:]
+    else:
+        # No array, most likely an error message
+        document = json.loads(head + buffer + utf8.decode(b'', final=True))
+        raise Exception('Failed to gather information from Web Service. '
+                        'Reason: {}'.format(document.get('error_msg')))
+    # Decode one element at a time
+    exhausted = False
+    while True:
+        idx = _whitespace.match(buffer).end()
+        if idx < len(buffer) and buffer[idx] == ']':
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, idx)
+            # A number may continue in the next chunk, so an element is
+            # only complete once the delimiter after it has been received
+            delimiter = _space.match(buffer, end).end()
+            if buffer[delimiter:delimiter + 1] not in (',', ']'):
+                raise ValueError("Expecting ',' delimiter: char {}"
+                                 "".format(delimiter))
+        except ValueError:
+            if exhausted:
+                raise
+            try:
+                buffer += utf8.decode(next(chunks))
+            except StopIteration:
+                buffer += utf8.decode(b'', final=True)
+                exhausted = True
+            continue
+        buffer = buffer[end:]
+        yield element
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError as exc:
+        raise ImportError("Tabular results require numpy") from exc
+    return numpy
+
+
+def _parse_timestamp(value):
+    """Parse one timestamp from the web service as a naive UTC datetime"""
+    try:
+        if isinstance(value, bool) or not isinstance(value,
+                                                     (int, float, str)):
+            return None
+        if not isinstance(value, str):
+            parsed = datetime.datetime.fromtimestamp(value,
+                                                     datetime.timezone.utc)
+        elif value.endswith('Z'):
+            # Older Pythons do not understand the Z suffix
+            parsed = datetime.datetime.fromisoformat(value[:-1] + '+00:00')
+        else:
+            try:
+                parsed = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc)
+    return parsed.replace(tzinfo=None)
+
+
+def _to_datetime64(values):
+    """
+    Convert timestamps from the web service to ``datetime64[us]``
+
+    ISO 8601 and RFC 2822 strings and seconds since the epoch are
+    understood. Strings with a UTC offset are converted to UTC, those
+    without are assumed to be UTC already. Anything else becomes NaT.
+    """
+    np = _import_numpy()
+    converted = np.full(len(values), np.datetime64('NaT'),
+                        dtype='datetime64[us]')
+    for i, value in enumerate(values):
+        parsed = _parse_timestamp(value)
+        if parsed is not None:
+            converted[i] = np.datetime64(parsed, 'us')
+    return converted
+
+
+def _as_table(columns, as_frame):
+    """Wrap a dictionary of columns in a DataFrame if requested"""
+    if as_frame is None or as_frame:
+        try:
+            import pandas
+        except ImportError as exc:
+            if as_frame:
+                raise ImportError("DataFrame results require pandas") from exc
+        else:
+            return pandas.DataFrame(columns)
+    return columns
+
 
 class PHPWebService:
     """
@@ -33,13 +168,36 @@ class PHPWebService:
 
     base_url : str, optional
         Point to a different server; possibly a test server.
+
+    pool_size : int, optional
+        Maximum number of connections kept open to the web service by the
+        default transport. Every request made by this object shares the same
+        pool.
+
+    transport : Transport, optional
+        Transport every request is made through. Defaults to a
+        :class:`.RequestsTransport`
+
+    attachment_cache : AttachmentCache, optional
+        Serve repeated attachment downloads from this cache
+
+    metadata_cache : MetadataCache, optional
+        Cache of logbook and experiment lookups. Unchanged lookups are
+        revalidated with conditional requests. A new cache is created if one
+        is not supplied
     """
     base_url = 'https://pswww.slac.stanford.edu'
 
-    def __init__(self, user=None, pw=None, base_url=None, dev=False):
+    def __init__(self, user=None, pw=None, base_url=None, dev=False,
+                 pool_size=10, attachment_cache=None, metadata_cache=None,
+                 transport=None):
         self._auth = None
+        self.attachment_cache = attachment_cache
+        self.metadata_cache = metadata_cache or MetadataCache()
         self._base_url = base_url if base_url else self.base_url
         self.url = None
+        # Reuse connections across requests and threads
+        self.transport = transport or RequestsTransport(pool_size=pool_size)
 
         self.authenticate(user=user, pw=pw)
 
@@ -53,8 +211,8 @@ class PHPWebService:
         Authorize use of the ELog
 
         If neither a username or password is supplied a Kerberos ticket will be
-        used to authenticate the use of the ELog. Otherwise basic HTTPBasicAuth
-        will be used.
+        used to authenticate the use of the ELog. Otherwise HTTP basic
+        authentication will be used.
 
         Parameters
         ----------
@@ -68,7 +226,8 @@ class PHPWebService:
         Returns
         -------
         auth: dict
-            Keywords necessary to properly authenticate a ``requests.get``
+            Keywords necessary to properly authenticate a
+            ``Transport.request``
         """
         auth = dict()
         logger.debug("Creating authentication information ...")
@@ -78,7 +237,7 @@ class PHPWebService:
             url = self._base_url + '/ws-auth'
             if not pw:
                 pw = getpass.getpass()
-            auth['auth'] = HTTPBasicAuth(user, pw)
+            auth['auth'] = (user, pw)
         else:
             user = getpass.getuser()
             # Create authentication URL and params for Kerberos
@@ -92,7 +251,7 @@ class PHPWebService:
         self._user = user
         return auth
 
-    def get_facilities_logbook(self, instrument):
+    def get_facilities_logbook(self, instrument, max_stale=None):
         """
         Gather Logbook information
 
@@ -101,6 +260,10 @@ class PHPWebService:
         instrument: str
             Name of the Instrument logbook
 
+        max_stale : float, optional
+            Accept a cached answer up to this many seconds old without
+            waiting for the web service. It is revalidated in the background
+
         Returns
         -------
         logbook_id : str
@@ -115,21 +278,17 @@ class PHPWebService:
         # Format correct URL
         url = (self._lgbk_base_url + '/lgbk/' + instrument + '/ws/info')
         # Make request to WebService
-        result = requests.get(url, **self._auth)
-        # Invalid HTTP code
-        if result.status_code >= 299:
-            raise Exception('Failed to gather facilities information '
-                            'from Web Service, HTTP status_code: {}'
-                            ''.format(result.status_code))
+        result = self._get_json(url, 'facilities information',
+                                max_stale=max_stale)
         # Find the name that matches the specified instrument
-        result = result.json()
         if result.get("success", False):
             return result["value"]["_id"]
         # If we never found our instrument
         raise Exception("Unable to find any Logbook for {}"
                         "".format(instrument))
 
-    def get_experiment_logbook(self, instrument, station=None):
+    def get_experiment_logbook(self, instrument, station=None,
+                               max_stale=None):
         """
         Gather information about the current experimental logbook
 
@@ -141,6 +300,10 @@ class PHPWebService:
         station : str, optional
             Specify a specific station at the instrument
 
+        max_stale : float, optional
+            Accept a cached answer up to this many seconds old without
+            waiting for the web service. It is revalidated in the background
+
         Returns
         -------
         logbook_id: str
@@ -157,7 +320,15 @@ class PHPWebService:
         """
 
         logger.debug("Requesting current experiment for %s", instrument)
-        # Format correct URL
+        url = self._experiment_url(instrument, station=station)
+        # Make request to WebService
+        result = self._get_json(url, 'current experiment information',
+                                max_stale=max_stale)
+        # Find experiment identification
+        return result['value']['name']
+
+    def _experiment_url(self, instrument, station=None):
+        """URL of the active experiment of an instrument"""
         url = (
             f'{self._lgbk_base_url}/lgbk/ws/'
             'activeexperiment_for_instrument_station'
@@ -165,19 +336,133 @@ class PHPWebService:
         )
         if station:
             url += f'&station={station}'
-        # Make request to WebService
-        result = requests.get(url, **self._auth)
-        # Invalid HTTP code
-        if result.status_code >= 299:
-            raise Exception('Failed to gather current experiment information '
-                            'from Web Service, HTTP status_code: {}'
-                            ''.format(result.status_code))
-        # Find experiment identification
-        result = result.json()
-        return result['value']['name']
+        return url
+
+    def get_run_table(self, logbook_id, entries=True, as_frame=None):
+        """
+        Gather the metadata of every run of an experiment
+
+        The runs are fetched in a single request and returned as columns,
+        so they can be joined against DAQ run tables without looping over
+        runs in Python.
+
+        Parameters
+        ----------
+        logbook_id: str
+            This is the name/id of the logbook; typically the experiment name.
+
+        entries : bool, optional
+            Count the ELog entries linked to each run. This costs one more
+            request; see :meth:`.get_entry_table`
+
+        as_frame : bool, optional
+            Return a ``pandas.DataFrame`` rather than a dictionary of NumPy
+            arrays. By default a DataFrame is returned if pandas is installed
+
+        Returns
+        -------
+        runs : pandas.DataFrame or dict
+            Columns ``run_num``, ``begin_time``, ``end_time``, ``duration``
+            in seconds and, optionally, ``n_entries``. Missing times are NaT
+
+        Example
+        -------
+        .. code:: python
+
+            runs = web.get_run_table('xppx12345')
+            daq = daq.merge(runs, on='run_num')
+        """
+        np = _import_numpy()
+        url = self._lgbk_base_url + "/lgbk/" + logbook_id + "/ws/runs"
+        result = self._get_json(url, 'run information')
+        if not result.get("success", False):
+            raise Exception("Unable to find runs for {}".format(logbook_id))
+        runs = result['value'] or []
+        run_num = np.array([run['num'] for run in runs], dtype=np.int64)
+        begin_time = _to_datetime64([run.get('begin_time') for run in runs])
+        end_time = _to_datetime64([run.get('end_time') for run in runs])
+        columns = {'run_num': run_num,
+                   'begin_time': begin_time,
+                   'end_time': end_time,
+                   'duration': (end_time - begin_time) / np.timedelta64(1, 's')}
+        if entries:
+            linked = self.get_entry_table(logbook_id,
+                                          as_frame=False)['run_num']
+            counts = np.zeros(len(run_num), dtype=np.int64)
+            if len(run_num):
+                # Match entries to runs with a single sorted search
+                order = np.argsort(run_num, kind='stable')
+                ordered = run_num[order]
+                index = np.searchsorted(ordered, linked)
+                index[index == len(ordered)] = 0
+                matched = ordered[index] == linked
+                counts[order] = np.bincount(index[matched],
+                                            minlength=len(run_num))
+            columns['n_entries'] = counts
+        return _as_table(columns, as_frame)
+
+    def get_entry_table(self, logbook_id, as_frame=None):
+        """
+        Gather the metadata of every entry of a logbook as columns
+
+        The entries are streamed, so only the metadata columns are held in
+        memory.
+
+        Parameters
+        ----------
+        logbook_id: str
+            This is the name/id of the logbook; typically the experiment name.
+
+        as_frame : bool, optional
+            Return a ``pandas.DataFrame`` rather than a dictionary of NumPy
+            arrays. By default a DataFrame is returned if pandas is installed
+
+        Returns
+        -------
+        entries : pandas.DataFrame or dict
+            Columns ``entry_id``, ``run_num``, ``insert_time``, ``author``
+            and ``title``. Entries without a run have a ``run_num`` of -1
+        """
+        np = _import_numpy()
+        ids, runs, times, authors, titles = [], [], [], [], []
+        for entry in self.iter_entries(logbook_id):
+            ids.append(entry['_id'])
+            run = entry.get('run_num')
+            runs.append(-1 if run in (None, '') else int(run))
+            times.append(entry.get('insert_time'))
+            authors.append(entry.get('author'))
+            titles.append(entry.get('title'))
+        columns = {'entry_id': np.array(ids, dtype=object),
+                   'run_num': np.array(runs, dtype=np.int64),
+                   'insert_time': _to_datetime64(times),
+                   'author': np.array(authors, dtype=object),
+                   'title': np.array(titles, dtype=object)}
+        return _as_table(columns, as_frame)
+
+    def _get_json(self, url, description, max_stale=None):
+        """GET a JSON document, through the metadata cache if there is one"""
+        def fetch(headers):
+            result = self._get(url, headers=headers)
+            # Invalid HTTP code
+            if result.status_code >= 299 and result.status_code != 304:
+                raise Exception('Failed to gather {} from Web Service, '
+                                'HTTP status_code: {}'
+                                ''.format(description, result.status_code))
+            return result
+
+        if self.metadata_cache is None:
+            return fetch({}).json()
+        return self.metadata_cache.get(url, fetch, max_stale=max_stale)
+
+    def _get(self, url, headers=None, **kwargs):
+        """GET a URL with our authentication and any extra headers"""
+        kwargs.update(self._auth)
+        if headers:
+            kwargs['headers'] = {**self._auth.get('headers', {}), **headers}
+        return self.transport.request('GET', url, **kwargs)
 
     def post(self, msg, logbook_id,
-             run=None, tags=None, attachments=None, title=None):
+             run=None, tags=None, attachments=None, title=None, parent=None):
         """
         Post an entry to the ELog
 
@@ -203,6 +488,15 @@ class PHPWebService:
 
         title : str, optional
             Interprets the message as a HTML message with this as the title
+
+        parent : str, optional
+            ID of an existing entry. If supplied, the message is posted as a
+            follow-up to that entry rather than as a new thread
+
+        Returns
+        -------
+        entry_id : str
+            ID of the newly created entry
         """
         logger.debug("Posting to Logbook ID: %s", logbook_id)
         # Basic post information
@@ -216,6 +510,8 @@ class PHPWebService:
             post['log_tags'] = " ".join(tags)
         if title:
             post['log_title'] = title
+        if parent:
+            post['parent'] = parent
 
         # Convert our attachments
         files = []
@@ -237,9 +533,11 @@ class PHPWebService:
         url = self._lgbk_base_url + "/lgbk/" \
             + logbook_id + "/ws/new_elog_entry"
         if files:
-            result = requests.post(url, data=post, files=files, **self._auth)
+            result = self.transport.request('POST', url, data=post,
+                                            files=files, **self._auth)
         else:
-            result = requests.post(url, data=post, **self._auth)
+            result = self.transport.request('POST', url, data=post,
+                                            **self._auth)
         # Invalid HTTP code
         if result.status_code >= 299:
             raise Exception('Failed to post information to Web Service. '
@@ -249,5 +547,121 @@ class PHPWebService:
         if not result['success']:
             raise Exception('Failed to post information to Web Service. '
                             'Reason: {}'.format(result['error_msg']))
-        else:
-            logger.info('New message ID: %s', result["value"]['_id'])
+        entry_id = result["value"]['_id']
+        logger.info('New message ID: %s', entry_id)
+        return entry_id
+
+    def iter_entries(self, logbook_id, chunk_size=65536):
+        """
+        Iterate over every entry of a logbook
+
+        The response of the web service is decoded as it is received, so
+        memory use does not grow with the size of the logbook.
+
+        Parameters
+        ----------
+        logbook_id: str
+            This is the name/id of the logbook; typically the experiment name.
+
+        chunk_size : int, optional
+            Number of bytes read from the response at a time
+
+        Yields
+        ------
+        entry : dict
+            Entry as returned by the web service
+        """
+        url = self._lgbk_base_url + "/lgbk/" + logbook_id + "/ws/elog"
+        with self._get(url, stream=True) as result:
+            # Invalid HTTP code
+            if result.status_code >= 299:
+                raise Exception('Failed to gather entries from Web Service. '
+                                'HTTP status_code: {}'
+                                ''.format(result.status_code))
+            yield from _iter_json_array(
+                result.iter_content(chunk_size=chunk_size))
+
+    def iter_attachment(self, logbook_id, entry_id, attachment_id,
+                        chunk_size=65536):
+        """
+        Download an attachment in pieces
+
+        If the service has an attachment cache, the whole attachment is read
+        through the cache instead.
+
+        Parameters
+        ----------
+        logbook_id: str
+            This is the name/id of the logbook; typically the experiment name.
+
+        entry_id : str
+            ID of the entry the attachment belongs to
+
+        attachment_id : str
+            ID of the attachment
+
+        chunk_size : int, optional
+            Number of bytes read from the response at a time
+
+        Yields
+        ------
+        chunk : bytes
+        """
+        if self.attachment_cache is not None:
+            content = self.get_attachment(logbook_id, entry_id,
+                                          attachment_id)
+            for start in range(0, len(content), chunk_size):
+                yield bytes(content[start:start + chunk_size])
+            return
+        url = self._lgbk_base_url + "/lgbk/" + logbook_id + "/ws/attachment"
+        params = {'entry_id': entry_id, 'attachment_id': attachment_id}
+        with self._get(url, params=params, stream=True) as result:
+            # Invalid HTTP code
+            if result.status_code >= 299:
+                raise Exception('Failed to download attachment from Web '
+                                'Service. HTTP status_code: {}'
+                                ''.format(result.status_code))
+            yield from result.iter_content(chunk_size=chunk_size)
+
+    def get_attachment(self, logbook_id, entry_id, attachment_id):
+        """
+        Download an attachment
+
+        Attachments never change once posted, so if the service has an
+        attachment cache repeated downloads are served from it without
+        contacting the web service.
+
+        Parameters
+        ----------
+        logbook_id: str
+            This is the name/id of the logbook; typically the experiment name.
+
+        entry_id : str
+            ID of the entry the attachment belongs to
+
+        attachment_id : str
+            ID of the attachment
+
+        Returns
+        -------
+        content : bytes or memoryview
+            Large attachments read from the cache are memory-mapped
+        """
+        if self.attachment_cache is None:
+            return self._download_attachment(logbook_id, entry_id,
+                                             attachment_id)
+        return self.attachment_cache.fetch(
+            f'{logbook_id}/{entry_id}/{attachment_id}',
+            lambda: self._download_attachment(logbook_id, entry_id,
+                                              attachment_id))
+
+    def _download_attachment(self, logbook_id, entry_id, attachment_id):
+        url = self._lgbk_base_url + "/lgbk/" + logbook_id + "/ws/attachment"
+        params = {'entry_id': entry_id, 'attachment_id': attachment_id}
+        result = self._get(url, params=params)
+        # Invalid HTTP code
+        if result.status_code >= 299:
+            raise Exception('Failed to download attachment from Web '
+                            'Service. HTTP status_code: {}'
+                            ''.format(result.status_code))
+        return result.content
@@ -0,0 +1,310 @@
+"""
+Recording and scaled replay of web service traffic
+
+:class:`RecordingTransport` wraps the transport of a :class:`.PHPWebService`
+and writes one line of metadata per request: when it was made, how long it
+took, the endpoint, the size of the form and of each attachment, and the
+outcome. Message text, titles, tags and attachment contents are never
+recorded.
+
+:func:`replay` sends requests of the same shape and size on the same
+schedule, optionally sped up, and reports throughput, latency and errors.
+"""
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .transport import Transport
+
+logger = logging.getLogger(__name__)
+
+# Requests that can not be replayed without their query parameters
+_unreplayable = {'attachment'}
+
+
+def _describe(url):
+    """Split a web service URL into logbook and endpoint"""
+    parts = urlparse(url).path.rstrip('/').split('/')
+    endpoint = parts[-1]
+    logbook = None
+    if len(parts) >= 3 and parts[-2] == 'ws' and parts[-3] != 'lgbk':
+        logbook = parts[-3]
+    return logbook, endpoint
+
+
+def _file_size(fileobj):
+    """Size of an open file without reading it"""
+    try:
+        return os.fstat(fileobj.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        return len(fileobj)
+    except TypeError:
+        return None
+
+
+class RecordingTransport(Transport):
+    """
+    Transport that records metadata of every request it forwards
+
+    Usage:
+
+        .. code-block:: python
+
+            transport = RecordingTransport(RequestsTransport(),
+                                           'traffic.jsonl')
+            el = HutchELog('XPP')
+            el.service.transport = transport
+
+    Parameters
+    ----------
+    transport : Transport
+        Transport that makes the requests
+
+    path : str
+        JSONL file to append the records to. Requests are stamped with the
+        wall clock time, so recordings of several sessions or hutches can be
+        appended to one file or merged by :func:`load_recording`.
+    """
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def request(self, method, url, params=None, data=None, files=None,
+                headers=None, auth=None, stream=False):
+        logbook, endpoint = _describe(url)
+        record = {'timestamp': time.time(),
+                  'method': method,
+                  'endpoint': endpoint,
+                  'logbook': logbook,
+                  'form_bytes': sum(len(str(key)) + len(str(value))
+                                    for key, value in (data or {}).items()),
+                  'attachment_bytes': [_file_size(fileobj) for
+                                       (_, (_, fileobj, _)) in files or []]}
+        start = time.monotonic()
+        try:
+            response = self.transport.request(
+                method, url, params=params, data=data, files=files,
+                headers=headers, auth=auth, stream=stream)
+        except Exception as exc:
+            record.update(duration=time.monotonic() - start, status=None,
+                          error=type(exc).__name__)
+            self._write(record)
+            raise
+        record.update(duration=time.monotonic() - start,
+                      status=response.status_code, error=None)
+        self._write(record)
+        return response
+
+    def _write(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.transport.close()
+
+
+def load_recording(*paths):
+    """
+    Read and merge recordings, sorted by when each request was made
+
+    Parameters
+    ----------
+    paths : str
+        JSONL files written by :class:`RecordingTransport`, e.g. one per
+        hutch
+
+    Returns
+    -------
+    records : list of dict
+    """
+    records = list()
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return sorted(records, key=lambda record: record['timestamp'])
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class ReplayReport:
+    """
+    Outcome of a :func:`replay`
+
+    Attributes
+    ----------
+    latencies : list of float
+        Time in seconds from when each request was due to when it completed
+
+    errors : int
+        Number of requests that raised or returned an HTTP error
+
+    elapsed : float
+        Wall time of the replay in seconds
+
+    endpoints : dict
+        Number of requests and errors for each endpoint
+
+    skipped : dict
+        Number of recorded requests to each endpoint that were not replayed
+    """
+    def __init__(self, latencies, errors, elapsed, endpoints, skipped=None):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.endpoints = endpoints
+        self.skipped = skipped or dict()
+
+    @property
+    def requests(self):
+        """Total number of requests replayed"""
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        """Requests per second"""
+        return self.requests / self.elapsed if self.elapsed else 0.
+
+    @property
+    def error_rate(self):
+        """Fraction of requests that failed"""
+        return self.errors / self.requests if self.requests else 0.
+
+    def percentile(self, pct):
+        """Latency at a percentile between 0 and 100"""
+        if not self.latencies:
+            return 0.
+        return _percentile(self.latencies, pct)
+
+    def summary(self):
+        """Human readable report"""
+        lines = [f'{self.requests} requests in {self.elapsed:.2f} s '
+                 f'({self.throughput:.1f} req/s), '
+                 f'{self.errors} errors ({self.error_rate:.2%})']
+        if self.latencies:
+            lines.append(
+                'latency mean {:.1f} ms, p50 {:.1f} ms, p90 {:.1f} ms, '
+                'p99 {:.1f} ms, max {:.1f} ms'.format(
+                    statistics.mean(self.latencies) * 1000,
+                    self.percentile(50) * 1000, self.percentile(90) * 1000,
+                    self.percentile(99) * 1000, self.latencies[-1] * 1000))
+        for endpoint, counts in sorted(self.endpoints.items()):
+            lines.append(f"  {endpoint}: {counts['requests']} requests, "
+                         f"{counts['errors']} errors")
+        for endpoint, count in sorted(self.skipped.items()):
+            lines.append(f'  {endpoint}: {count} skipped')
+        return '\n'.join(lines)
+
+
+def replay(records, service, rate=1.0, max_workers=16):
+    """
+    Send requests shaped like a recording
+
+    Requests are made on the recorded schedule divided by ``rate``. Each
+    has the recorded method, endpoint and logbook, a form of the recorded
+    size and attachments of the recorded sizes filled with placeholder
+    bytes. Query parameters are not recorded, so attachment downloads can
+    not be replayed. They are counted in ``ReplayReport.skipped`` instead.
+
+    Parameters
+    ----------
+    records : list of dict
+        Records as returned by :func:`load_recording`
+
+    service : PHPWebService
+        Service whose transport, authentication and URL are used
+
+    rate : float, optional
+        Speed up factor of the schedule, e.g. 10 for ten times faster
+
+    max_workers : int, optional
+        Maximum number of requests in flight
+
+    Returns
+    -------
+    report : ReplayReport
+    """
+    base_url = service._lgbk_base_url
+    replayable, skipped = list(), dict()
+    for record in records:
+        endpoint = record['endpoint']
+        if endpoint in _unreplayable:
+            skipped[endpoint] = skipped.get(endpoint, 0) + 1
+        else:
+            replayable.append(record)
+    records = replayable
+    latencies, endpoints = list(), dict()
+    errors = [0]
+    lock = threading.Lock()
+    with tempfile.TemporaryDirectory() as tmp:
+        attachments = dict()
+
+        def attachment(size):
+            # One placeholder file per distinct size
+            with lock:
+                if size not in attachments:
+                    filename = os.path.join(tmp, f'{size}.bin')
+                    with open(filename, 'wb') as f:
+                        f.truncate(size)
+                    attachments[size] = filename
+                return attachments[size]
+
+        def send(record, due):
+            if record.get('logbook'):
+                url = (f"{base_url}/lgbk/{record['logbook']}/ws/"
+                       f"{record['endpoint']}")
+            else:
+                url = f"{base_url}/lgbk/ws/{record['endpoint']}"
+            data = files = None
+            if record['method'] == 'POST':
+                data = {'log_text': 'x' * max(0, record['form_bytes'] - 8)}
+                files = [('files', (f'{size}.bin',
+                                    open(attachment(size), 'rb'), None))
+                         for size in record['attachment_bytes'] if size]
+            failed = False
+            try:
+                response = service.transport.request(
+                    record['method'], url, data=data, files=files,
+                    **service._auth)
+                failed = response.status_code >= 299
+            except Exception:
+                logger.debug("Replayed request failed", exc_info=True)
+                failed = True
+            finally:
+                for (_, (_, fileobj, _)) in files or []:
+                    fileobj.close()
+            with lock:
+                latencies.append(time.monotonic() - due)
+                errors[0] += failed
+                counts = endpoints.setdefault(record['endpoint'],
+                                              {'requests': 0, 'errors': 0})
+                counts['requests'] += 1
+                counts['errors'] += failed
+
+        origin = records[0]['timestamp'] if records else 0.
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix='replay') as pool:
+            for record in records:
+                due = start + (record['timestamp'] - origin) / rate
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, record, due)
+        elapsed = time.monotonic() - start
+    return ReplayReport(latencies, errors[0], elapsed, endpoints, skipped)
@@ -0,0 +1,156 @@
+"""
+Priority aware scheduling of ELog posts
+"""
+import enum
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    """Priority classes for posts, lower values are served first"""
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+
+class PostScheduler:
+    """
+    Run posts on a pool of worker threads in priority order
+
+    Each priority class has its own first-in first-out queue. Whenever a
+    worker becomes free it takes the oldest post of the most important class
+    that is below its concurrency limit. With two or more workers, bulk posts
+    may by default never occupy every worker, so an interactive post never
+    waits for more than one in-flight request to finish. A single worker is
+    shared by every class, and an interactive post may then wait for the
+    bulk post in flight.
+
+    To keep lower classes from starving under a constant stream of more
+    important posts, a queued post is promoted by one class for every
+    ``aging`` seconds it has waited.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of posts that may be in flight at once
+
+    limits : dict, optional
+        Mapping of :class:`Priority` to the maximum number of concurrent
+        posts of that class. Classes that are not included may use every
+        worker, except for ``BULK`` which defaults to one fewer, but at
+        least one.
+
+    aging : float, optional
+        Time in seconds a post waits before it is promoted by one class. Use
+        None to disable promotion.
+    """
+    def __init__(self, max_workers=4, limits=None, aging=30.0):
+        self.max_workers = max_workers
+        self.limits = {priority: max_workers for priority in Priority}
+        self.limits[Priority.BULK] = max(1, max_workers - 1)
+        self.limits.update(limits or {})
+        self.aging = aging
+        self._queues = {priority: deque() for priority in Priority}
+        self._running = {priority: 0 for priority in Priority}
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._workers = [threading.Thread(target=self._work, daemon=True,
+                                          name=f'PostScheduler-{i}')
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, func, *args, priority=Priority.NORMAL, **kwargs):
+        """
+        Schedule ``func(*args, **kwargs)``
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+        """
+        priority = Priority(priority)
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Unable to submit to a scheduler that "
+                                   "has been shut down")
+            self._queues[priority].append(
+                (time.monotonic(), future, func, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def queued(self, priority=None):
+        """Number of posts waiting, optionally of a single class"""
+        with self._cond:
+            if priority is not None:
+                return len(self._queues[Priority(priority)])
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _next(self):
+        """Pop the next eligible job, must hold the condition"""
+        now = time.monotonic()
+        best = None
+        for priority, queue in self._queues.items():
+            if not queue or self._running[priority] >= self.limits[priority]:
+                continue
+            queued_at = queue[0][0]
+            rank = priority
+            if self.aging:
+                rank -= int((now - queued_at) / self.aging)
+            if best is None or (rank, queued_at) < best[:2]:
+                best = (rank, queued_at, priority)
+        if best is None:
+            return None, None
+        priority = best[2]
+        self._running[priority] += 1
+        return priority, self._queues[priority].popleft()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                priority, job = self._next()
+                while job is None:
+                    if self._shutdown and not self.queued():
+                        return
+                    self._cond.wait()
+                    priority, job = self._next()
+            _, future, func, args, kwargs = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args, **kwargs))
+                    except BaseException as exc:
+                        future.set_exception(exc)
+            finally:
+                with self._cond:
+                    self._running[priority] -= 1
+                    self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting posts
+
+        Posts that are already queued are still run.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Block until every queued post has finished
+        """
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
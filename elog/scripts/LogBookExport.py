@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Archive every entry of a logbook, and optionally its attachments, to JSONL or
+Parquet. Interrupted exports resume from their last checkpoint when the same
+command is run again.
+"""
+import argparse
+import logging
+import sys
+
+from elog.export import IncompleteExport, LogbookExporter
+from elog.pswww import PHPWebService
+
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A command-line utility \
+        to export the electronic logbook of an experiment.')
+    parser.add_argument('-e', '--experiment', required=True,
+                        help='The name of the experiment to export.')
+    parser.add_argument('-o', '--output', required=True,
+                        help='The output file for JSONL, or directory for \
+                        Parquet.')
+    # Optional arguments start here
+    parser.add_argument('-f', '--format', choices=['jsonl', 'parquet'],
+                        help='The output format. By default this is taken \
+                        from the extension of the output.')
+    parser.add_argument('-a', '--attachments',
+                        help='Download the attachments into this directory.')
+    parser.add_argument('-n', '--workers', default=4, type=int,
+                        help='The number of concurrent attachment downloads.')
+    parser.add_argument('-b', '--batch', default=1000, type=int,
+                        help='The number of entries between checkpoints.')
+    parser.add_argument('-w', '--webserviceurl',
+                        default='https://pswww.slac.stanford.edu',
+                        help='The logbook webservice endpoint.')
+    parser.add_argument('-u', '--user',
+                        help='User id for authentication. \
+                        If authenticating using Kerberos, please skip this.')
+    parser.add_argument('-p', '--password',
+                        help='Password for authentication. If authenticating \
+                        using Kerberos, please skip this.')
+    args = parser.parse_args()
+
+    service = PHPWebService(user=args.user, pw=args.password,
+                            base_url=args.webserviceurl)
+    exporter = LogbookExporter(service, args.experiment, args.output,
+                               fmt=args.format, attachments=args.attachments,
+                               max_workers=args.workers,
+                               batch_size=args.batch)
+    try:
+        count = exporter.run()
+    except IncompleteExport as exc:
+        logger.error('%s', exc)
+        sys.exit(1)
+    logger.info('Exported %s entries to %s', count, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Replay traffic recorded with elog.recorder.RecordingTransport against a local
+stand-in logbook, or another web service, and report throughput, latency and
+errors. Recordings of several hutches are merged into one schedule. Use a rate of 10 or 100 to see how the client and server cope with
+ten or a hundred times the recorded load.
+"""
+import argparse
+import logging
+
+from elog.mock_server import MockLogbook, MockLogbookServer
+from elog.pswww import PHPWebService
+from elog.recorder import load_recording, replay
+from elog.transport import HTTPXTransport, RequestsTransport
+
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A command-line utility \
+        to replay recorded electronic logbook traffic.')
+    parser.add_argument('recordings', nargs='+',
+                        help='The JSONL files written by RecordingTransport, \
+                        e.g. one per hutch. They are merged by the time of \
+                        each request.')
+    # Optional arguments start here
+    parser.add_argument('-r', '--rate', default=1.0, type=float,
+                        help='Speed up factor of the recorded schedule, \
+                        e.g. 10 or 100.')
+    parser.add_argument('-n', '--workers', default=16, type=int,
+                        help='The maximum number of requests in flight.')
+    parser.add_argument('-w', '--webserviceurl',
+                        help='The logbook webservice endpoint to replay \
+                        against. By default a local stand-in is started.')
+    parser.add_argument('-d', '--delay', default=0.0, type=float,
+                        help='Seconds the local stand-in takes per request.')
+    parser.add_argument('-t', '--transport', default='requests',
+                        choices=['requests', 'httpx'],
+                        help='The HTTP client to replay with.')
+    parser.add_argument('-u', '--user',
+                        help='User id for authentication with the \
+                        webservice. If authenticating using Kerberos, please \
+                        skip this.')
+    parser.add_argument('-p', '--password',
+                        help='Password for authentication. If authenticating \
+                        using Kerberos, please skip this.')
+    args = parser.parse_args()
+
+    records = load_recording(*args.recordings)
+    if args.transport == 'httpx':
+        transport = HTTPXTransport()
+    else:
+        transport = RequestsTransport(pool_size=args.workers)
+    server = None
+    if args.webserviceurl is None:
+        server = MockLogbookServer(MockLogbook(delay=args.delay))
+        server.start()
+        service = PHPWebService(user='replay', pw='replay',
+                                base_url=server.url, transport=transport)
+    else:
+        service = PHPWebService(user=args.user, pw=args.password,
+                                base_url=args.webserviceurl,
+                                transport=transport)
+    logger.info('Replaying %s requests against %s at %sx',
+                len(records), server.url if server else args.webserviceurl,
+                args.rate)
+    try:
+        report = replay(records, service, rate=args.rate,
+                        max_workers=args.workers)
+    finally:
+        transport.close()
+        if server is not None:
+            server.stop()
+    print(report.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Compact HTML rendering of tabular data for posts
+
+:func:`render_html` turns a DataFrame, array or dictionary into an HTML
+table that stays within a byte budget. Rows that do not fit are replaced by
+a marker between the first and last rows, and summary statistics of the
+whole table are added below. :func:`write_data` saves the complete table so
+that it can be attached alongside the truncated rendering.
+"""
+import html
+import logging
+import math
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+Rendered = namedtuple('Rendered', ('html', 'rows', 'shown'))
+
+_extensions = {'csv': '.csv.gz', 'parquet': '.parquet'}
+
+
+def _import_pandas():
+    try:
+        import pandas
+    except ImportError as exc:
+        raise ImportError("Rendering tables requires pandas, install "
+                          "elog[tables]") from exc
+    return pandas
+
+
+def as_frame(data):
+    """
+    Convert tabular data to a DataFrame
+
+    Parameters
+    ----------
+    data : DataFrame, Series, array or dict
+        One dimensional arrays become a single column and two dimensional
+        arrays a column per array column. Dictionaries of scalars become a
+        single column indexed by key, other dictionaries a column per key
+
+    Returns
+    -------
+    frame : DataFrame
+    """
+    pandas = _import_pandas()
+    import numpy as np
+    if isinstance(data, pandas.DataFrame):
+        return data
+    if isinstance(data, pandas.Series):
+        return data.to_frame()
+    if isinstance(data, dict):
+        if all(np.ndim(value) == 0 for value in data.values()):
+            return pandas.DataFrame({'value': list(data.values())},
+                                    index=list(data.keys()))
+        return pandas.DataFrame(data)
+    array = np.asarray(data)
+    if array.dtype.names is not None:
+        # Structured arrays have a column per field
+        return pandas.DataFrame(array)
+    if array.ndim == 1:
+        return pandas.DataFrame({'value': array})
+    if array.ndim > 2:
+        raise ValueError("Can not render an array with {} dimensions"
+                         "".format(array.ndim))
+    return pandas.DataFrame(np.atleast_2d(array))
+
+
+def _format(values, precision):
+    """Format a column of values as escaped strings in one pass"""
+    import numpy as np
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return np.char.mod(f'%.{precision}g', values)
+    text = values.astype(str)
+    if values.dtype.kind in 'iub':
+        return text
+    # Only the few cells holding markup need escaping
+    special = np.zeros(len(text), dtype=bool)
+    for char in '&<>':
+        special |= np.char.find(text, char) >= 0
+    if special.any():
+        text = text.astype(object)
+        text[special] = [html.escape(cell, quote=False)
+                         for cell in text[special]]
+    return text
+
+
+def _rows(frame, positions, precision):
+    """Render the rows at the given positions"""
+    columns = [_format(frame.index.to_numpy()[positions], precision)]
+    columns.extend(_format(frame.iloc[positions, i].to_numpy(), precision)
+                   for i in range(frame.shape[1]))
+    return ['<tr><th>' + index + '</th><td>' + '</td><td>'.join(cells)
+            + '</td></tr>' for index, *cells in zip(*columns)]
+
+
+def _summary(frame, precision):
+    """Render count, mean, min and max of every column"""
+    import numpy as np
+    counts = frame.count().to_numpy()
+    numeric = frame.select_dtypes('number').select_dtypes(exclude='bool')
+    rows = ['<tr><th>count</th><td>' + '</td><td>'.join(
+        _format(counts, precision)) + '</td></tr>']
+    if not numeric.shape[1]:
+        return rows
+    stats = numeric.agg(['mean', 'min', 'max'])
+    for name in stats.index:
+        cells = np.full(frame.shape[1], '', dtype=object)
+        where = frame.columns.get_indexer(numeric.columns)
+        cells[where] = _format(stats.loc[name].to_numpy(dtype=float),
+                               precision)
+        rows.append(f'<tr><th>{name}</th><td>' + '</td><td>'.join(cells)
+                    + '</td></tr>')
+    return rows
+
+
+def _lengths(rows):
+    return [len(row.encode()) for row in rows]
+
+
+def _gap(n_columns, omitted, n_rows):
+    """Render the row marking where rows were left out"""
+    return ('<tr><td colspan="{}">&hellip; {} of {} rows omitted &hellip;'
+            '</td></tr>'.format(n_columns + 1, omitted, n_rows))
+
+
+def render_html(data, max_bytes=65536, precision=6, summary=True):
+    """
+    Render tabular data as a compact HTML table
+
+    Each column is formatted in a single vectorized operation, so large
+    tables render quickly. If the table does not fit in ``max_bytes``, only
+    as many of its first and last rows as fit are shown, separated by a
+    row counting those left out.
+
+    Parameters
+    ----------
+    data : DataFrame, Series, array or dict
+        Data to render, see :func:`as_frame`
+
+    max_bytes : int, optional
+        Approximate size limit of the HTML. The column headers and summary
+        are always included
+
+    precision : int, optional
+        Significant digits of floating point values
+
+    summary : bool, optional
+        Add the count of each column and the mean, min and max of numeric
+        columns below the table when rows are left out
+
+    Returns
+    -------
+    rendered : Rendered
+        The HTML along with the number of rows in the data and the number
+        of rows shown
+    """
+    import numpy as np
+    frame = as_frame(data)
+    n_rows, n_columns = frame.shape
+    head = ('<table><thead><tr><th></th><th>'
+            + '</th><th>'.join(html.escape(str(column))
+                               for column in frame.columns)
+            + '</th></tr></thead><tbody>')
+    foot = '</tbody></table>'
+    if summary:
+        foot = '</tbody><tfoot>{}</tfoot></table>'.format(
+            ''.join(_summary(frame, precision)))
+    available = max_bytes - len(head.encode()) - len(foot.encode())
+    # No row can be shorter than its tags and one character per cell, which
+    # bounds the number of rows worth formatting
+    limit = max(0, available) // (10 * (n_columns + 1) + 9)
+    if n_rows <= limit:
+        rows = _rows(frame, np.arange(n_rows), precision)
+        if not n_rows or sum(_lengths(rows)) <= available:
+            return Rendered(head + ''.join(rows) + '</tbody></table>',
+                            n_rows, n_rows)
+        first, last = rows, rows[::-1]
+    else:
+        first = _rows(frame, np.arange(math.ceil(limit / 2)), precision)
+        last = _rows(frame, np.arange(n_rows - limit // 2, n_rows)[::-1],
+                     precision)
+    # Alternate between the first and last rows until the budget is spent,
+    # leaving room for the marker of the rows left out
+    available -= len(_gap(n_columns, n_rows, n_rows).encode())
+    shown = np.arange(min(n_rows - 1, len(first) + len(last)) + 1)
+    n_first, n_last = (shown + 1) // 2, shown // 2
+    valid = (n_first <= len(first)) & (n_last <= len(last))
+    n_first, n_last = n_first[valid], n_last[valid]
+    total = (np.concatenate([[0], np.cumsum(_lengths(first))])[n_first]
+             + np.concatenate([[0], np.cumsum(_lengths(last))])[n_last])
+    fits = np.nonzero(total <= available)[0]
+    best = fits[-1] if len(fits) else 0
+    n_first, n_last = int(n_first[best]), int(n_last[best])
+    omitted = n_rows - n_first - n_last
+    return Rendered(head + ''.join(first[:n_first])
+                    + _gap(n_columns, omitted, n_rows)
+                    + ''.join(last[:n_last][::-1]) + foot,
+                    n_rows, n_first + n_last)
+
+
+def write_data(data, path, fmt='csv'):
+    """
+    Save the complete data behind a rendered table
+
+    Parameters
+    ----------
+    data : DataFrame, Series, array or dict
+        Data to save, see :func:`as_frame`
+
+    path : str
+        Path of the file without extension. ``.csv.gz`` or ``.parquet`` is
+        appended depending on the format
+
+    fmt : {'csv', 'parquet'}, optional
+        Gzip compressed CSV, or Parquet which also requires ``pyarrow``
+
+    Returns
+    -------
+    path : str
+        Path of the file written
+    """
+    if fmt not in _extensions:
+        raise ValueError("Unknown format {!r}, expected one of {}"
+                         "".format(fmt, ', '.join(_extensions)))
+    frame = as_frame(data)
+    path = path + _extensions[fmt]
+    if fmt == 'csv':
+        frame.to_csv(path, compression='gzip')
+    else:
+        frame.rename(columns=str).to_parquet(path)
+    logger.debug("Wrote %s rows to %s", len(frame), path)
+    return path
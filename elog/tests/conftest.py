@@ -2,6 +2,7 @@ import getpass
 
 import pytest
 
+from elog.mock_server import MockLogbook, MockLogbookServer
 from elog.pswww import PHPWebService
 
 
@@ -16,6 +17,18 @@ def pytest_addoption(parser):
                      help='Whether to include tests that post to the ELog')
 
 
+@pytest.fixture(scope='function')
+def mock_server():
+    logbook = MockLogbook(experiments={'TST': 'tstx12345'})
+    with MockLogbookServer(logbook) as server:
+        yield server
+
+
+@pytest.fixture(scope='function')
+def mock_pswww(mock_server):
+    yield PHPWebService(user='user', pw='pw', base_url=mock_server.url)
+
+
 def pytest_generate_tests(metafunc):
     # Create a ws-kerb webservice
     services = []
@@ -0,0 +1,80 @@
+import os
+import time
+
+from elog.cache import AttachmentCache, MetadataCache
+from elog.transport import Response
+
+image_png = os.path.join(os.path.dirname(__file__), 'lenna.png')
+
+
+def test_attachment_cache(tmp_path):
+    cache = AttachmentCache(str(tmp_path))
+    assert cache.get('a') is None
+    digest = cache.put('a', b'content')
+    # Identical content is only stored once
+    assert cache.put('b', b'content') == digest
+    assert len(list((tmp_path / 'objects').rglob('*'))) == 2
+    assert cache.get('a') == b'content'
+    assert cache.get('b') == b'content'
+    assert cache.metrics() == {'hits': 2, 'misses': 1,
+                               'hit_rate': 2 / 3, 'bytes_saved': 14}
+    # Other processes see the same cache
+    assert AttachmentCache(str(tmp_path)).get('a') == b'content'
+
+
+def test_attachment_cache_mmap(tmp_path):
+    cache = AttachmentCache(str(tmp_path), mmap_threshold=4)
+    cache.put('large', b'large content')
+    content = cache.get('large')
+    assert isinstance(content, memoryview)
+    assert content.readonly
+    assert bytes(content) == b'large content'
+
+
+def test_attachment_cache_eviction(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=350)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key.encode() * 100)
+        time.sleep(0.01)
+    # Use the oldest object so that b is the least recently used
+    assert cache.get('a') is not None
+    cache.put('d', b'd' * 100)
+    assert cache.get('b') is None
+    for key in ('a', 'c', 'd'):
+        assert cache.get(key) == key.encode() * 100
+    # The key of the evicted object is removed along with it
+    assert len(os.listdir(tmp_path / 'keys')) == 3
+
+
+def test_pswww_attachment_cache(mock_pswww, mock_server, tmp_path):
+    mock_pswww.attachment_cache = AttachmentCache(str(tmp_path))
+    entry_id = mock_pswww.post('Image', 'tstx12345', attachments=[image_png])
+    attachment_id = mock_server.logbook.entries['tstx12345'][0][
+        'attachments'][0]['_id']
+    with open(image_png, 'rb') as f:
+        expected = f.read()
+    requests = len(mock_server.logbook.requests)
+    assert mock_pswww.get_attachment('tstx12345', entry_id,
+                                     attachment_id) == expected
+    assert len(mock_server.logbook.requests) == requests + 1
+    # Repeated fetches never reach the web service
+    assert bytes(mock_pswww.get_attachment('tstx12345', entry_id,
+                                           attachment_id)) == expected
+    assert b''.join(mock_pswww.iter_attachment('tstx12345', entry_id,
+                                               attachment_id)) == expected
+    assert len(mock_server.logbook.requests) == requests + 1
+    assert mock_pswww.attachment_cache.bytes_saved == 2 * len(expected)
+
+
+def test_metadata_cache_unexpected_not_modified():
+    responses = [Response(304, {}, content=b''),
+                 Response(200, {'ETag': '"a"'}, content=b'{"value": 1}')]
+    requests = list()
+
+    def fetch(headers):
+        requests.append(headers)
+        return responses.pop(0)
+
+    cache = MetadataCache()
+    assert cache.get('url', fetch) == {'value': 1}
+    assert requests == [{}, {'Cache-Control': 'no-cache'}]
@@ -0,0 +1,130 @@
+import statistics
+import threading
+
+import pytest
+
+from elog.callbacks import RunningStats, RunSummaryCallback
+from elog.elog import ELog
+from elog.mock_server import MockLogbook
+from elog.scheduler import PostScheduler, Priority
+from elog.transport import InMemoryTransport
+
+
+class RecordingELog:
+    # Minimal ELog that remembers what was posted
+    def __init__(self):
+        self.posts = list()
+        self.scheduler = None
+        self.enable_run_posts = True
+        self.posted = threading.Event()
+
+    def post(self, msg, **kwargs):
+        self.posts.append((msg, kwargs))
+        self.posted.set()
+        return {'experiment': str(len(self.posts))}
+
+
+def run_documents(num_events=10, page=False):
+    yield 'start', {'uid': 'start-uid', 'time': 100., 'scan_id': 42,
+                    'daq_run': 7,
+                    'plan_name': 'scan', 'motors': ['x'],
+                    'detectors': ['det']}
+    yield 'descriptor', {'uid': 'desc-uid', 'name': 'primary',
+                         'run_start': 'start-uid'}
+    data = [{'x': float(i), 'det': i ** 2, 'image': [[0, 1]],
+             'name': 'label', 'flag': True}
+            for i in range(num_events)]
+    if page:
+        yield 'event_page', {'descriptor': 'desc-uid',
+                             'data': {key: [row[key] for row in data]
+                                      for key in data[0]}}
+    else:
+        for row in data:
+            yield 'event', {'descriptor': 'desc-uid', 'data': row}
+    yield 'stop', {'run_start': 'start-uid', 'time': 110.,
+                   'exit_status': 'success',
+                   'num_events': {'primary': num_events}}
+
+
+def test_running_stats():
+    values = [1.5, -2., 3.25, 8., 0.]
+    stats = RunningStats()
+    for value in values:
+        stats.update(value)
+    assert stats.count == 5
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.std == pytest.approx(statistics.stdev(values))
+    assert (stats.min, stats.max) == (-2., 8.)
+
+
+@pytest.mark.parametrize('page', [False, True])
+def test_run_summary_callback(page):
+    elog = RecordingELog()
+    callback = RunSummaryCallback(elog, tags=['scan'])
+    for name, doc in run_documents(page=page):
+        callback(name, doc)
+    assert elog.posted.wait(timeout=5)
+    msg, kwargs = elog.posts[0]
+    # The scan_id is not mistaken for a DAQ run number
+    assert kwargs == {'run': None, 'tags': ['scan'], 'title': 'scan 42'}
+    assert '<td>x</td><td>10</td><td>4.5</td>' in msg
+    assert '<td>det</td><td>10</td><td>28.5</td>' in msg
+    # Only scalar fields are summarized
+    for key in ('image', 'name', 'flag'):
+        assert f'<td>{key}</td>' not in msg
+    assert '10.0 s' in msg
+
+
+def test_run_summary_callback_run_key():
+    elog = RecordingELog()
+    callback = RunSummaryCallback(elog, run_key='daq_run')
+    for name, doc in run_documents():
+        callback(name, doc)
+    assert elog.posted.wait(timeout=5)
+    assert elog.posts[0][1]['run'] == 7
+
+
+def test_run_summary_callback_scheduler(monkeypatch):
+    logbook = MockLogbook()
+    with PostScheduler(max_workers=1) as scheduler:
+        priorities = list()
+        submit = scheduler.submit
+
+        def record_priority(func, *args, priority=Priority.NORMAL, **kwargs):
+            priorities.append(priority)
+            return submit(func, *args, priority=priority, **kwargs)
+
+        monkeypatch.setattr(scheduler, 'submit', record_priority)
+        elog = ELog({'experiment': 'tstx12345'}, user='user', pw='pw',
+                    base_url='http://memory', scheduler=scheduler)
+        elog.service.transport = InMemoryTransport(logbook)
+        callback = RunSummaryCallback(elog, run_key='daq_run')
+        for name, doc in run_documents():
+            callback(name, doc)
+    assert priorities == [Priority.BULK]
+    (entry,) = logbook.entries['tstx12345']
+    assert entry['title'] == 'scan 42'
+    assert entry['run_num'] == '7'
+
+
+def test_run_summary_callback_scheduler_failure(monkeypatch, caplog):
+    def fail(*args, **kwargs):
+        raise Exception('Failed to post to the web service')
+
+    with PostScheduler(max_workers=1) as scheduler:
+        elog = ELog({'experiment': 'tstx12345'}, user='user', pw='pw',
+                    base_url='http://memory', scheduler=scheduler)
+        monkeypatch.setattr(elog.service, 'post', fail)
+        callback = RunSummaryCallback(elog)
+        for name, doc in run_documents():
+            callback(name, doc)
+    assert 'Unable to post run summary' in caplog.text
+
+
+def test_run_summary_callback_disabled():
+    elog = RecordingELog()
+    elog.enable_run_posts = False
+    callback = RunSummaryCallback(elog)
+    for name, doc in run_documents():
+        callback(name, doc)
+    assert not elog.posted.wait(timeout=0.1)
@@ -1,10 +1,14 @@
 import os
+import threading
+import time
 
 import pytest
 
 import elog.elog
-from elog.elog import HutchELog
+from elog.elog import FacilityELog, HutchELog
+from elog.scheduler import PostScheduler, Priority
 from elog.utils import clear_registry, registry
+from elog.watcher import ExperimentWatcher
 
 
 @pytest.fixture(scope='module')
@@ -14,15 +18,17 @@ def patch_webservice():
 
         def __init__(self, *args, **kwargs):
             self.posts = list()
+            self.experiment = '1'
 
         def post(self, *args, **kwargs):
             self.posts.append((args, kwargs))
+            return str(len(self.posts))
 
         def get_facilities_logbook(self, instrument):
             return '0'
 
         def get_experiment_logbook(self, instrument, station=None):
-            return '1'
+            return self.experiment
 
     # Store value
     orig_web = elog.elog.PHPWebService
@@ -84,6 +90,222 @@ def test_elog_set(mockelog):
     assert st.done and st.success
 
 
+def test_elog_scheduler(mockelog):
+    with PostScheduler(max_workers=2) as scheduler:
+        mockelog.scheduler = scheduler
+        try:
+            assert mockelog.post('Operator note',
+                                 priority=Priority.INTERACTIVE) == {
+                'experiment': '1'}
+            futures = mockelog.post('Automated', facility=True, wait=False,
+                                    priority=Priority.BULK)
+            assert {future.result(timeout=5)
+                    for future in futures.values()} == {'2', '3'}
+            st = mockelog.set('From the RunEngine')
+            st.wait(timeout=5)
+            assert st.done and st.success
+            assert mockelog.service.posts[-1][0][0] == 'From the RunEngine'
+        finally:
+            mockelog.scheduler = None
+
+
+def test_elog_post_returns_ids(mockelog):
+    assert mockelog.post('Experiment') == {'experiment': '1'}
+    assert mockelog.post('Both', facility=True) == {'facility': '2',
+                                                    'experiment': '3'}
+
+
+def test_elog_post_table(mockelog):
+    pandas = pytest.importorskip('pandas')
+    mockelog.post_table({'energy': 9.5}, 'Scan results', msg='<p>Scan</p>')
+    (msg, _), kwargs = mockelog.service.posts[-1]
+    assert msg.startswith('<p>Scan</p><table>')
+    assert kwargs['title'] == 'Scan results'
+    assert kwargs['attachments'] == []
+    # Tables beyond the budget attach the complete data
+    frame = pandas.DataFrame({'x': range(10000)})
+    mockelog.post_table(frame, 'Scan results', max_bytes=1000,
+                        facility=True)
+    assert len(mockelog.service.posts) == 3
+    (msg, _), kwargs = mockelog.service.posts[-1]
+    assert len(msg) <= 1000
+    assert 'rows omitted' in msg
+    (path,) = kwargs['attachments']
+    assert path.endswith('data.csv.gz')
+    # Removed once posted
+    assert not os.path.exists(path)
+
+
+def test_elog_incremental_entry(mockelog):
+    entry = mockelog.start_entry('Scan started', min_interval=60)
+    assert entry.entry_ids == {'1': '1'}
+    # Updates within the interval are coalesced
+    entry.update('step 1', tags='scan')
+    entry.update('step 2', tags=['scan', 'done'], attachments=['a.png'])
+    assert len(mockelog.service.posts) == 1
+    assert entry.pending
+    entry.close()
+    assert not entry.pending
+    assert len(mockelog.service.posts) == 2
+    args, kwargs = mockelog.service.posts[-1]
+    assert args == ('step 1\nstep 2', '1')
+    assert kwargs['parent'] == '1'
+    assert kwargs['tags'] == ['scan', 'done']
+    assert kwargs['attachments'] == ['a.png']
+    with pytest.raises(RuntimeError):
+        entry.update('too late')
+
+
+def test_elog_incremental_entry_experiment_swap(mockelog, monkeypatch):
+    post = mockelog.service.post
+
+    def swap_experiment(*args, **kwargs):
+        # The watcher swaps the experiment while the entry is posted
+        mockelog.logbooks['experiment'] = '5'
+        return post(*args, **kwargs)
+
+    monkeypatch.setattr(mockelog.service, 'post', swap_experiment)
+    try:
+        entry = mockelog.start_entry('Scan started', min_interval=60)
+    finally:
+        mockelog.logbooks['experiment'] = '1'
+    # Follow-ups go to the logbook the entry was posted to
+    assert entry.entry_ids == {'1': '1'}
+
+
+def test_elog_incremental_entry_scheduler(mockelog, monkeypatch):
+    with PostScheduler(max_workers=2) as scheduler:
+        priorities = list()
+        submit = scheduler.submit
+
+        def record_priority(func, *args, priority=Priority.NORMAL, **kwargs):
+            priorities.append(priority)
+            return submit(func, *args, priority=priority, **kwargs)
+
+        monkeypatch.setattr(scheduler, 'submit', record_priority)
+        mockelog.scheduler = scheduler
+        try:
+            entry = mockelog.start_entry('Scan started', min_interval=0)
+            entry.update('step 1')
+            entry.update('step 2')
+            entry.close()
+        finally:
+            mockelog.scheduler = None
+    assert priorities == [Priority.INTERACTIVE, Priority.BULK, Priority.BULK]
+    assert [args[0] for (args, _) in mockelog.service.posts] == [
+        'Scan started', 'step 1', 'step 2']
+    assert all(kwargs['parent'] == '1'
+               for (_, kwargs) in mockelog.service.posts[1:])
+
+
+def test_elog_incremental_entry_scheduler_congested(mockelog):
+    with PostScheduler(max_workers=2) as scheduler:
+        mockelog.scheduler = scheduler
+        try:
+            entry = mockelog.start_entry('Scan started', min_interval=0)
+            # Fill the bulk queue with slow posts
+            for _ in range(10):
+                scheduler.submit(time.sleep, 0.05, priority=Priority.BULK)
+            start = time.monotonic()
+            for step in range(5):
+                entry.update(f'step {step}')
+            # Updates are queued rather than waiting for the bulk posts
+            assert time.monotonic() - start < 0.25
+            entry.close()
+        finally:
+            mockelog.scheduler = None
+    assert [args[0] for (args, _) in mockelog.service.posts] == [
+        'Scan started'] + [f'step {step}' for step in range(5)]
+
+
+def test_elog_incremental_entry_scheduler_failure(mockelog, monkeypatch):
+    def fail(*args, **kwargs):
+        raise ValueError('Unreachable')
+
+    with PostScheduler(max_workers=2) as scheduler:
+        mockelog.scheduler = scheduler
+        try:
+            entry = mockelog.start_entry('Scan started', min_interval=0)
+            monkeypatch.setattr(mockelog.service, 'post', fail)
+            entry.update('step 1')
+            with pytest.raises(ValueError):
+                entry.close()
+        finally:
+            mockelog.scheduler = None
+
+
+def test_elog_incremental_entry_no_interval(mockelog):
+    with mockelog.start_entry('Scan', facility=True, min_interval=0) as entry:
+        entry.update('step 1')
+        assert len(mockelog.service.posts) == 4
+    assert {kw['parent'] for (_, kw) in mockelog.service.posts[2:]} == {'1',
+                                                                        '2'}
+
+
+def test_experiment_watcher(mockelog):
+    changes = list()
+    watcher = ExperimentWatcher(
+        mockelog, callback=lambda old, new: changes.append((old, new)))
+    # Unchanged experiment
+    mockelog.service.experiment = '1'
+    assert not watcher.poll()
+    # Experiment changeover
+    mockelog.service.experiment = '5'
+    assert watcher.poll()
+    assert mockelog.logbooks['experiment'] == '5'
+    assert changes == [('1', '5')]
+    mockelog.post('New experiment')
+    assert mockelog.service.posts[-1][0][1] == '5'
+    mockelog.logbooks['experiment'] = '1'
+    mockelog.service.experiment = '1'
+
+
+def test_experiment_watcher_thread(mockelog):
+    changed = threading.Event()
+    mockelog.service.experiment = '1'
+    watcher = mockelog.start_experiment_watcher(
+        interval=0.01, callback=lambda old, new: changed.set())
+    try:
+        assert watcher.running
+        mockelog.service.experiment = '6'
+        assert changed.wait(timeout=5)
+        assert mockelog.logbooks['experiment'] == '6'
+    finally:
+        mockelog.stop_experiment_watcher()
+        mockelog.logbooks['experiment'] = '1'
+        mockelog.service.experiment = '1'
+    assert not watcher.running
+    assert mockelog.watcher is None
+
+
+def test_facility_elog(patch_webservice, monkeypatch):
+    def get_experiment_logbook(self, instrument, station=None):
+        if instrument == 'TMO':
+            raise ValueError('No active experiment')
+        return instrument.lower() + '12345'
+
+    monkeypatch.setattr(elog.elog.PHPWebService, 'get_experiment_logbook',
+                        get_experiment_logbook)
+    el = FacilityELog(['XPP', 'tmo'])
+    assert el.instruments == ['XPP', 'TMO']
+    assert el.logbooks == {'XPP:facility': '0',
+                           'XPP:experiment': 'xpp12345',
+                           'TMO:facility': '0'}
+    el.post('Experiment')
+    assert [args[1] for (args, _) in el.service.posts] == ['xpp12345']
+    el.post('Facility', instruments=['tmo'], experiment=False, facility=True)
+    assert el.service.posts[-1][0][1] == '0'
+    assert el.post('Experiment', instruments=['xpp']) == {
+        'XPP:experiment': '3'}
+    assert len(el.service.posts) == 3
+    # Requested logbooks that were not found are an error
+    with pytest.raises(ValueError, match='TMO:experiment'):
+        el.post('Experiment', instruments=['XPP', 'TMO'])
+    with pytest.raises(ValueError):
+        el.post('Experiment', instruments=['AMO'])
+    assert len(el.service.posts) == 3
+
+
 def test_elog_from_conf(temporary_config):
     # Fake ELog that stores the username and pw internally
     class TestELog(HutchELog):
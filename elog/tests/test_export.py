@@ -0,0 +1,134 @@
+import json
+import os.path
+
+import pytest
+
+from elog.export import IncompleteExport, LogbookExporter
+
+image_png = os.path.join(os.path.dirname(__file__), 'lenna.png')
+
+
+@pytest.fixture(scope='function')
+def logbook(mock_pswww):
+    for i in range(5):
+        mock_pswww.post(f'Entry {i}', 'tstx12345', run=i,
+                        attachments=[image_png] if i % 2 else None)
+    yield 'tstx12345'
+
+
+class InterruptedService:
+    # Fails after a number of entries, as if the connection dropped
+    def __init__(self, service, after):
+        self.service = service
+        self.after = after
+
+    def iter_entries(self, logbook_id):
+        for i, entry in enumerate(self.service.iter_entries(logbook_id)):
+            if i == self.after:
+                raise ConnectionError('Connection dropped')
+            yield entry
+
+    def iter_attachment(self, *args, **kwargs):
+        return self.service.iter_attachment(*args, **kwargs)
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_export_jsonl(mock_pswww, logbook, tmp_path):
+    path = str(tmp_path / 'export.jsonl')
+    attachments = tmp_path / 'attachments'
+    exporter = LogbookExporter(mock_pswww, logbook, path, batch_size=2,
+                               attachments=str(attachments))
+    assert exporter.run() == 5
+    entries = read_jsonl(path)
+    assert [entry['content'] for entry in entries] == [f'Entry {i}'
+                                                       for i in range(5)]
+    assert not os.path.exists(exporter.checkpoint_path)
+    # Every attachment was downloaded intact
+    for entry in entries:
+        for attachment in entry['attachments']:
+            filename = (attachments / entry['_id']
+                        / f"{attachment['_id']}_lenna.png")
+            assert filename.read_bytes() == open(image_png, 'rb').read()
+    assert len(list(attachments.iterdir())) == 2
+
+
+def test_export_resume(mock_pswww, logbook, tmp_path):
+    path = str(tmp_path / 'export.jsonl')
+    exporter = LogbookExporter(InterruptedService(mock_pswww, 3), logbook,
+                               path, batch_size=2)
+    with pytest.raises(ConnectionError):
+        exporter.run()
+    assert exporter.load_checkpoint()['entries'] == 2
+    assert len(read_jsonl(path)) == 2
+    # Resume with a working connection
+    exporter = LogbookExporter(mock_pswww, logbook, path, batch_size=2)
+    assert exporter.run() == 5
+    assert [entry['content'] for entry in read_jsonl(path)] == [
+        f'Entry {i}' for i in range(5)]
+
+
+def test_export_resume_changed(mock_pswww, mock_server, logbook, tmp_path):
+    path = str(tmp_path / 'export.jsonl')
+    exporter = LogbookExporter(InterruptedService(mock_pswww, 3), logbook,
+                               path, batch_size=2)
+    with pytest.raises(ConnectionError):
+        exporter.run()
+    # Entries were removed since the checkpoint, so start over
+    del mock_server.logbook.entries[logbook][:2]
+    exporter = LogbookExporter(mock_pswww, logbook, path, batch_size=2)
+    assert exporter.run() == 3
+    assert len(read_jsonl(path)) == 3
+
+
+def test_export_parquet(mock_pswww, logbook, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'export.parquet')
+    exporter = LogbookExporter(InterruptedService(mock_pswww, 3), logbook,
+                               path, batch_size=2)
+    with pytest.raises(ConnectionError):
+        exporter.run()
+    exporter = LogbookExporter(mock_pswww, logbook, path, batch_size=2)
+    assert exporter.run() == 5
+    assert sorted(os.listdir(path)) == ['part-00000.parquet',
+                                        'part-00001.parquet',
+                                        'part-00002.parquet']
+    table = pq.read_table(path)
+    assert table.column('content').to_pylist() == [f'Entry {i}'
+                                                   for i in range(5)]
+    assert table.column('run_num').to_pylist() == [None, 1, 2, 3, 4]
+
+
+class FlakyAttachments(InterruptedService):
+    # Fails to download the first attachment
+    def __init__(self, service):
+        super().__init__(service, after=None)
+        self.failures = 1
+
+    def iter_attachment(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Connection dropped')
+        return self.service.iter_attachment(*args, **kwargs)
+
+
+def test_export_failed_attachments(mock_pswww, logbook, tmp_path):
+    path = str(tmp_path / 'export.jsonl')
+    attachments = tmp_path / 'attachments'
+    exporter = LogbookExporter(FlakyAttachments(mock_pswww), logbook, path,
+                               batch_size=2, attachments=str(attachments))
+    with pytest.raises(IncompleteExport):
+        exporter.run()
+    # The failure is kept to be retried
+    checkpoint = exporter.load_checkpoint()
+    assert checkpoint['entries'] == 5
+    assert len(checkpoint['failed']) == 1
+    assert len(list(attachments.glob('*/*.png'))) == 1
+    exporter = LogbookExporter(mock_pswww, logbook, path, batch_size=2,
+                               attachments=str(attachments))
+    assert exporter.run() == 5
+    assert not os.path.exists(exporter.checkpoint_path)
+    assert len(list(attachments.glob('*/*.png'))) == 2
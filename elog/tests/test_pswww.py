@@ -1,9 +1,14 @@
+import json
 import logging
 import os.path
+import time
+import warnings
 
 import pytest
 
-from elog.pswww import PHPWebService
+from elog.elog import FacilityELog, HutchELog
+from elog.pswww import PHPWebService, _iter_json_array, _to_datetime64
+from elog.watcher import ExperimentWatcher
 
 logger = logging.getLogger(__name__)
 
@@ -29,3 +34,152 @@ def test_pswww_post_smoke():
     pswww.post(msg, 'diadaq13', tags=['test'],
                attachments=[(image_png, 'Canonical test image "Lenna"'),
                             image_png])
+
+
+def test_pswww_mock_notebooks(mock_pswww):
+    assert mock_pswww.get_facilities_logbook('TST_Instrument') == \
+        'TST_Instrument'
+    assert mock_pswww.get_experiment_logbook('TST') == 'tstx12345'
+
+
+def test_pswww_mock_experiment_watcher(mock_server):
+    el = HutchELog('TST', user='user', pw='pw', base_url=mock_server.url)
+    watcher = ExperimentWatcher(el)
+    assert not watcher.poll()
+    # Unchanged experiments are revalidated without a body
+    assert el.service.metadata_cache.metrics()['revalidated'] == 1
+    mock_server.logbook.experiments['TST'] = 'tstx67890'
+    assert watcher.poll()
+    assert el.logbooks['experiment'] == 'tstx67890'
+
+
+def test_pswww_mock_post(mock_pswww, mock_server):
+    entry_id = mock_pswww.post(msg, 'tstx12345', run=12, tags=['test'],
+                               title='Title', attachments=[image_png])
+    followup_id = mock_pswww.post('Follow-up', 'tstx12345', parent=entry_id)
+    entry, followup = mock_server.logbook.entries['tstx12345']
+    assert entry['_id'] == entry_id
+    assert entry['content'] == msg
+    assert entry['run_num'] == '12'
+    assert entry['tags'] == ['test']
+    assert entry['attachments'][0]['size'] == os.path.getsize(image_png)
+    assert followup['_id'] == followup_id
+    assert followup['parent'] == entry_id
+
+
+def test_pswww_mock_metadata_cache(mock_pswww, mock_server):
+    cache = mock_pswww.metadata_cache
+    assert mock_pswww.get_experiment_logbook('TST') == 'tstx12345'
+    assert mock_pswww.get_facilities_logbook('TST_Instrument') == \
+        'TST_Instrument'
+    assert cache.metrics() == {'hits': 0, 'revalidated': 0, 'misses': 2}
+    # Unchanged documents are revalidated rather than downloaded
+    assert mock_pswww.get_experiment_logbook('TST') == 'tstx12345'
+    assert mock_pswww.get_facilities_logbook('TST_Instrument') == \
+        'TST_Instrument'
+    assert cache.metrics() == {'hits': 0, 'revalidated': 2, 'misses': 2}
+    mock_server.logbook.experiments['TST'] = 'tstx67890'
+    assert mock_pswww.get_experiment_logbook('TST') == 'tstx67890'
+    assert cache.metrics()['misses'] == 3
+
+
+def test_pswww_mock_stale_while_revalidate(mock_pswww, mock_server):
+    cache = mock_pswww.metadata_cache
+    assert mock_pswww.get_experiment_logbook('TST') == 'tstx12345'
+    mock_server.logbook.experiments['TST'] = 'tstx67890'
+    # The stale answer is returned while the cache updates in the background
+    assert mock_pswww.get_experiment_logbook('TST',
+                                             max_stale=60) == 'tstx12345'
+    assert cache.metrics()['hits'] == 1
+    deadline = time.monotonic() + 5
+    while cache.metrics()['misses'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert mock_pswww.get_experiment_logbook('TST',
+                                             max_stale=60) == 'tstx67890'
+    # Answers older than max_stale are always revalidated first
+    mock_server.logbook.experiments['TST'] = 'tstx12345'
+    assert mock_pswww.get_experiment_logbook('TST',
+                                             max_stale=0) == 'tstx12345'
+
+
+@pytest.fixture(scope='function')
+def runs(mock_pswww, mock_server):
+    mock_server.logbook.runs['tstx12345'] = [
+        {'num': 2, 'begin_time': '2024-01-01T00:10:00Z',
+         'end_time': '2024-01-01T00:15:30Z'},
+        {'num': 1, 'begin_time': '2024-01-01T00:00:00+00:00',
+         'end_time': '2024-01-01T00:05:00Z'},
+        {'num': 3, 'begin_time': '2024-01-01T00:20:00Z', 'end_time': None},
+    ]
+    for run in (1, 2, 2, None, 7):
+        mock_pswww.post(f'Run {run}', 'tstx12345', run=run)
+    yield 'tstx12345'
+
+
+def test_pswww_mock_run_table(mock_pswww, mock_server, runs):
+    np = pytest.importorskip('numpy')
+    requests = len(mock_server.logbook.requests)
+    table = mock_pswww.get_run_table(runs, as_frame=False)
+    assert len(mock_server.logbook.requests) == requests + 2
+    np.testing.assert_array_equal(table['run_num'], [2, 1, 3])
+    np.testing.assert_array_equal(table['n_entries'], [2, 1, 0])
+    np.testing.assert_array_equal(table['duration'][:2], [330., 300.])
+    assert np.isnan(table['duration'][2])
+    assert table['begin_time'][1] == np.datetime64('2024-01-01T00:00:00')
+    assert np.isnat(table['end_time'][2])
+    entries = mock_pswww.get_entry_table(runs, as_frame=False)
+    np.testing.assert_array_equal(entries['run_num'], [1, 2, 2, -1, 7])
+
+
+def test_to_datetime64():
+    np = pytest.importorskip('numpy')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        converted = _to_datetime64([
+            '2024-01-01T00:10:00Z', '2024-01-01T00:10:00.250000',
+            '2023-12-31T16:10:00-08:00', 'Mon, 01 Jan 2024 00:10:00 GMT',
+            1704067800, 'not a time', None, True])
+    expected = np.datetime64('2024-01-01T00:10:00', 'us')
+    np.testing.assert_array_equal(
+        converted[:5], [expected, expected + np.timedelta64(250, 'ms'),
+                        expected, expected, expected])
+    assert np.isnat(converted[5:]).all()
+
+
+def test_pswww_mock_run_frame(mock_pswww, runs):
+    pytest.importorskip('pandas')
+    runs = mock_pswww.get_run_table(runs, as_frame=True)
+    assert list(runs.columns) == ['run_num', 'begin_time', 'end_time',
+                                  'duration', 'n_entries']
+    assert runs.set_index('run_num')['n_entries'].to_dict() == {1: 1, 2: 2,
+                                                                3: 0}
+
+
+def test_facility_elog_mock_server(mock_server, caplog):
+    mock_server.logbook.experiments = {'XPP': 'xppx12345',
+                                       'XCS': 'xcsx12345'}
+    # Keep every lookup in flight at once
+    mock_server.logbook.delay = 0.05
+    el = FacilityELog(user='user', pw='pw', base_url=mock_server.url)
+    # Every connection of the concurrent lookups is kept for reuse
+    assert 'Connection pool is full' not in caplog.text
+    assert el.post('Sample change complete',
+                   instruments=['XPP', 'xcs']) == {
+        'XPP:experiment': mock_server.logbook.entries['xppx12345'][0]['_id'],
+        'XCS:experiment': mock_server.logbook.entries['xcsx12345'][0]['_id']}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1000])
+def test_iter_json_array(chunk_size):
+    document = json.dumps({'success': True,
+                           'value': [12345, 678, -1.5e10, 'text', None,
+                                     {'_id': 'a', 'runs': [1, 22]}, []]})
+    data = document.encode()
+    chunks = (data[i:i + chunk_size]
+              for i in range(0, len(data), chunk_size))
+    assert list(_iter_json_array(chunks)) == json.loads(document)['value']
+
+
+def test_iter_json_array_truncated():
+    with pytest.raises(ValueError):
+        list(_iter_json_array([b'{"value": [12345, 678']))
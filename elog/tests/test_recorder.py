@@ -0,0 +1,80 @@
+import os.path
+import time
+
+from elog.mock_server import MockLogbook
+from elog.pswww import PHPWebService
+from elog.recorder import RecordingTransport, load_recording, replay
+from elog.transport import InMemoryTransport
+
+image_png = os.path.join(os.path.dirname(__file__), 'lenna.png')
+
+
+def test_recording(tmp_path):
+    path = str(tmp_path / 'traffic.jsonl')
+    transport = RecordingTransport(
+        InMemoryTransport(MockLogbook(experiments={'TST': 'tstx12345'})),
+        path)
+    service = PHPWebService(user='user', pw='pw', base_url='http://memory',
+                            transport=transport)
+    assert service.get_experiment_logbook('TST') == 'tstx12345'
+    service.post('Secret message', 'tstx12345', title='Secret title',
+                 tags=['secret'], attachments=[image_png])
+    transport.close()
+    lookup, post = load_recording(path)
+    assert lookup['endpoint'] == 'activeexperiment_for_instrument_station'
+    assert lookup['logbook'] is None
+    assert (post['method'], post['endpoint'], post['logbook']) == \
+        ('POST', 'new_elog_entry', 'tstx12345')
+    assert post['attachment_bytes'] == [os.path.getsize(image_png)]
+    assert post['form_bytes'] > len('Secret message')
+    assert post['status'] == 200 and post['error'] is None
+    assert post['timestamp'] >= lookup['timestamp']
+    with open(path) as f:
+        assert 'Secret' not in f.read()
+
+
+def test_replay():
+    records = [{'timestamp': 1e9 + i * 0.01, 'method': 'POST',
+                'endpoint': 'new_elog_entry', 'logbook': 'tstx12345',
+                'form_bytes': 100, 'attachment_bytes': [1000]}
+               for i in range(20)]
+    records.append({'timestamp': 1e9 + 0.2, 'method': 'GET',
+                    'endpoint': 'attachment',
+                    'logbook': 'tstx12345', 'form_bytes': 0,
+                    'attachment_bytes': []})
+    logbook = MockLogbook()
+    service = PHPWebService(user='user', pw='pw', base_url='http://memory',
+                            transport=InMemoryTransport(logbook))
+    report = replay(records, service, rate=10)
+    assert report.requests == 20
+    assert report.errors == 0
+    assert report.endpoints == {'new_elog_entry': {'requests': 20,
+                                                   'errors': 0}}
+    # Downloads can not be replayed without the recorded attachment
+    assert report.skipped == {'attachment': 1}
+    # The recorded 0.2 s schedule ten times faster
+    assert report.elapsed < 0.2
+    assert report.percentile(50) <= report.percentile(99)
+    assert len(logbook.entries['tstx12345']) == 20
+    assert logbook.attachments
+    assert 'p99' in report.summary()
+    assert 'attachment: 1 skipped' in report.summary()
+
+
+def test_recording_sessions(tmp_path):
+    paths = [str(tmp_path / f'{hutch}.jsonl') for hutch in ('xpp', 'mfx')]
+    logbook = MockLogbook(experiments={'TST': 'tstx12345'})
+    # Two sessions appended to one file and a third in another
+    for path in (paths[0], paths[1], paths[0]):
+        transport = RecordingTransport(InMemoryTransport(logbook), path)
+        service = PHPWebService(user='user', pw='pw',
+                                base_url='http://memory', transport=transport)
+        service.get_experiment_logbook('TST')
+        transport.close()
+        time.sleep(0.1)
+    records = load_recording(*paths)
+    assert len(records) == 3
+    # Sessions keep their spacing rather than all starting at once
+    gaps = [later['timestamp'] - earlier['timestamp']
+            for earlier, later in zip(records, records[1:])]
+    assert all(gap >= 0.1 for gap in gaps)
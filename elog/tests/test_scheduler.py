@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from elog.scheduler import PostScheduler, Priority
+
+
+def block(scheduler, gate, priority=Priority.NORMAL):
+    # Occupy a worker until the gate is opened
+    started = threading.Event()
+
+    def wait():
+        started.set()
+        return gate.wait(timeout=5)
+
+    future = scheduler.submit(wait, priority=priority)
+    assert started.wait(timeout=5)
+    return future
+
+
+def test_scheduler_priority_order():
+    gate = threading.Event()
+    order = list()
+    with PostScheduler(max_workers=1) as scheduler:
+        blocker = block(scheduler, gate)
+        for i in range(3):
+            scheduler.submit(order.append, f'bulk{i}', priority=Priority.BULK)
+        scheduler.submit(order.append, 'normal')
+        scheduler.submit(order.append, 'operator',
+                         priority=Priority.INTERACTIVE)
+        try:
+            assert scheduler.queued() == 5
+            assert scheduler.queued(Priority.BULK) == 3
+        finally:
+            gate.set()
+        assert blocker.result(timeout=5)
+    assert order == ['operator', 'normal', 'bulk0', 'bulk1', 'bulk2']
+
+
+def test_scheduler_limits():
+    gate = threading.Event()
+    with PostScheduler(max_workers=2) as scheduler:
+        # Bulk posts may only occupy one of the two workers
+        bulk = [scheduler.submit(gate.wait, 5, priority=Priority.BULK)
+                for _ in range(3)]
+        operator = scheduler.submit(lambda: 'done',
+                                    priority=Priority.INTERACTIVE)
+        try:
+            assert operator.result(timeout=5) == 'done'
+            assert not any(future.done() for future in bulk)
+        finally:
+            gate.set()
+        assert all(future.result(timeout=5) for future in bulk)
+
+
+def test_scheduler_aging():
+    gate = threading.Event()
+    order = list()
+    with PostScheduler(max_workers=1, aging=0.05) as scheduler:
+        block(scheduler, gate)
+        scheduler.submit(order.append, 'bulk', priority=Priority.BULK)
+        time.sleep(0.15)
+        scheduler.submit(order.append, 'operator',
+                         priority=Priority.INTERACTIVE)
+        gate.set()
+    assert order == ['bulk', 'operator']
+
+
+def test_scheduler_exception():
+    with PostScheduler(max_workers=1) as scheduler:
+        future = scheduler.submit(int, 'not a number')
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    with pytest.raises(RuntimeError):
+        scheduler.submit(int, '1')
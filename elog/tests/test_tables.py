@@ -0,0 +1,65 @@
+import pytest
+
+from elog.tables import render_html, write_data
+
+np = pytest.importorskip('numpy')
+pandas = pytest.importorskip('pandas')
+
+
+def test_render_html():
+    frame = pandas.DataFrame({'x': [1, 2], 'y': [0.5, 1 / 3],
+                              'z': ['<b>', 'a & b']})
+    rendered = render_html(frame, precision=3)
+    assert rendered == (
+        '<table><thead><tr><th></th><th>x</th><th>y</th><th>z</th></tr>'
+        '</thead><tbody>'
+        '<tr><th>0</th><td>1</td><td>0.5</td><td>&lt;b&gt;</td></tr>'
+        '<tr><th>1</th><td>2</td><td>0.333</td><td>a &amp; b</td></tr>'
+        '</tbody></table>', 2, 2)
+
+
+def test_render_html_inputs():
+    assert render_html({'a': 1, 'b': 2}).html.count('<tr>') == 3
+    assert render_html({'a': [1, 2, 3], 'b': [4, 5, 6]}).rows == 3
+    assert render_html(np.arange(5)).rows == 5
+    assert render_html(np.zeros((4, 3))).html.count('<td>') == 12
+    assert render_html(pandas.DataFrame({'a': []})).shown == 0
+    with pytest.raises(ValueError):
+        render_html(np.zeros((2, 2, 2)))
+
+
+@pytest.mark.parametrize('max_bytes', [0, 500, 2000, 20000])
+def test_render_html_budget(max_bytes):
+    frame = pandas.DataFrame({'x': np.arange(100000),
+                              'y': np.linspace(0, 1, 100000)})
+    rendered = render_html(frame, max_bytes=max_bytes)
+    assert rendered.rows == 100000
+    assert rendered.shown < rendered.rows
+    assert f'{rendered.rows - rendered.shown} of 100000 rows omitted' in \
+        rendered.html
+    # Summary statistics cover every row
+    assert '<tr><th>count</th><td>100000</td><td>100000</td></tr>' in \
+        rendered.html
+    assert '<tr><th>max</th><td>99999</td><td>1</td></tr>' in rendered.html
+    if max_bytes >= 2000:
+        assert len(rendered.html.encode()) <= max_bytes
+        # Both ends of the table are shown
+        assert '<tr><th>0</th>' in rendered.html
+        assert '<tr><th>99999</th>' in rendered.html
+
+
+def test_write_data(tmp_path):
+    frame = pandas.DataFrame({'x': [1, 2, 3], 'y': ['a', 'b', 'c']})
+    path = write_data(frame, str(tmp_path / 'data'))
+    assert path.endswith('.csv.gz')
+    pandas.testing.assert_frame_equal(pandas.read_csv(path, index_col=0),
+                                      frame)
+    with pytest.raises(ValueError):
+        write_data(frame, str(tmp_path / 'data'), fmt='xlsx')
+
+
+def test_write_data_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = write_data(np.arange(6).reshape(3, 2), str(tmp_path / 'data'),
+                      fmt='parquet')
+    assert list(pandas.read_parquet(path).columns) == ['0', '1']
@@ -0,0 +1,128 @@
+"""
+Conformance tests that every transport must pass identically
+"""
+import os.path
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from elog.mock_server import MockLogbook, MockLogbookServer
+from elog.pswww import PHPWebService
+from elog.transport import (HTTPXTransport, InMemoryTransport,
+                            RequestsTransport, Transport, TransportError)
+
+image_png = os.path.join(os.path.dirname(__file__), 'lenna.png')
+
+
+@pytest.fixture(scope='function', params=['requests', 'httpx', 'memory'])
+def service(request):
+    logbook = MockLogbook(experiments={'TST': 'tstx12345'})
+    if request.param == 'memory':
+        transport = InMemoryTransport(logbook)
+        yield PHPWebService(user='user', pw='pw', base_url='http://memory',
+                            transport=transport)
+        return
+    if request.param == 'httpx':
+        pytest.importorskip('httpx')
+        pytest.importorskip('h2')
+        transport = HTTPXTransport()
+    else:
+        transport = RequestsTransport()
+    with MockLogbookServer(logbook) as server:
+        yield PHPWebService(user='user', pw='pw', base_url=server.url,
+                            transport=transport)
+    transport.close()
+
+
+def test_transport_lookups(service):
+    assert service.get_facilities_logbook('TST_Instrument') == \
+        'TST_Instrument'
+    assert service.get_experiment_logbook('TST') == 'tstx12345'
+    assert service.get_experiment_logbook('TST') == 'tstx12345'
+    assert service.metadata_cache.metrics() == {'hits': 0, 'revalidated': 1,
+                                                'misses': 2}
+
+
+def test_transport_errors(service):
+    with pytest.raises(Exception, match='HTTP status_code: 404'):
+        service.get_attachment('tstx12345', 'entry', 'missing')
+    with pytest.raises(Exception, match='HTTP status_code: 404'):
+        list(service.iter_attachment('tstx12345', 'entry', 'missing'))
+
+
+def test_transport_post(service):
+    entry_id = service.post('Message', 'tstx12345', run=3, tags=['a', 'b'],
+                            title='Title',
+                            attachments=[(image_png, 'Image')])
+    followup_id = service.post('Follow-up', 'tstx12345', parent=entry_id)
+    entry, followup = service.iter_entries('tstx12345')
+    assert entry['_id'] == entry_id
+    assert (entry['content'], entry['title']) == ('Message', 'Title')
+    assert entry['tags'] == ['a', 'b']
+    assert entry['run_num'] == '3'
+    assert followup['_id'] == followup_id
+    assert followup['parent'] == entry_id
+    attachment = entry['attachments'][0]
+    assert attachment['name'] == 'Image'
+    with open(image_png, 'rb') as f:
+        expected = f.read()
+    assert service.get_attachment('tstx12345', entry_id,
+                                  attachment['_id']) == expected
+    assert b''.join(service.iter_attachment(
+        'tstx12345', entry_id, attachment['_id'], chunk_size=1000)) == expected
+
+
+def test_transport_concurrent_posts(service):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ids = list(pool.map(lambda i: service.post(f'Post {i}', 'tstx12345'),
+                            range(50)))
+    assert len(set(ids)) == 50
+    assert sorted(entry['content'] for entry in service.iter_entries(
+        'tstx12345')) == sorted(f'Post {i}' for i in range(50))
+
+
+@pytest.fixture(scope='function', params=['requests', 'httpx'])
+def network_transport(request):
+    # Transports that can fail to reach the web service
+    def create(timeout):
+        if request.param == 'httpx':
+            pytest.importorskip('httpx')
+            pytest.importorskip('h2')
+            return HTTPXTransport(timeout=timeout)
+        return RequestsTransport(timeout=timeout)
+    return create
+
+
+def test_transport_unreachable(network_transport):
+    # Find a port that nothing is listening on
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    service = PHPWebService(user='user', pw='pw',
+                            base_url=f'http://127.0.0.1:{port}',
+                            transport=network_transport(timeout=5))
+    with pytest.raises(TransportError):
+        service.get_experiment_logbook('TST')
+    # Callers written for requests still catch the failure
+    with pytest.raises(requests.ConnectionError):
+        service.post('Message', 'tstx12345')
+
+
+def test_transport_timeout(network_transport):
+    logbook = MockLogbook(experiments={'TST': 'tstx12345'}, delay=1.0)
+    transport = network_transport(timeout=0.1)
+    with MockLogbookServer(logbook) as server:
+        service = PHPWebService(user='user', pw='pw', base_url=server.url,
+                                transport=transport)
+        with pytest.raises(TransportError):
+            service.get_experiment_logbook('TST')
+        with pytest.raises(requests.Timeout):
+            service.get_experiment_logbook('TST')
+    transport.close()
+
+
+def test_transport_abstract():
+    with pytest.raises(TypeError):
+        Transport()
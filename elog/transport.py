@@ -0,0 +1,310 @@
+"""
+HTTP transports used by :class:`.PHPWebService`
+
+Every request made to the web service goes through a :class:`Transport`.
+The default :class:`RequestsTransport` uses a pooled ``requests.Session``;
+:class:`HTTPXTransport` can multiplex concurrent requests over a single
+HTTP/2 connection; :class:`InMemoryTransport` calls a
+:class:`.MockLogbook` directly, without sockets, for tests and benchmarks.
+"""
+import abc
+import json
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+
+class TransportError(requests.RequestException):
+    """
+    The web service could not be reached or stopped responding
+
+    This subclasses ``requests.RequestException``, and the subclasses below
+    ``requests.ConnectionError`` and ``requests.Timeout``, so code that
+    caught the exceptions of ``requests`` keeps working with any transport.
+    """
+
+
+class TransportConnectionError(TransportError, requests.ConnectionError):
+    """The connection to the web service failed"""
+
+
+class TransportTimeout(TransportError, requests.Timeout):
+    """The web service did not respond in time"""
+
+
+class _ConnectTimeout(TransportConnectionError, TransportTimeout):
+    """Connecting to the web service timed out"""
+
+
+def _transport_error(exc, message, connect_timeouts, timeouts,
+                     connection_errors):
+    """Wrap an exception of the HTTP client in the matching TransportError"""
+    if isinstance(exc, connect_timeouts):
+        error = _ConnectTimeout
+    elif isinstance(exc, timeouts):
+        error = TransportTimeout
+    elif isinstance(exc, connection_errors):
+        error = TransportConnectionError
+    else:
+        error = TransportError
+    return error(message.format(exc))
+
+
+def _translate_errors(stream, errors, classes):
+    """Raise TransportError for failures while streaming a body"""
+    def translated(chunk_size):
+        try:
+            yield from stream(chunk_size)
+        except errors as exc:
+            raise _transport_error(exc, 'Failed to read response from Web '
+                                   'Service: {}', *classes) from exc
+    return translated
+
+
+class Response:
+    """
+    Response of a :class:`Transport`
+
+    Parameters
+    ----------
+    status_code : int
+
+    headers : dict
+
+    content : bytes, optional
+        Body of the response if it has already been read
+
+    stream : callable, optional
+        Called as ``stream(chunk_size)`` to iterate over the body when it
+        has not been read yet
+
+    close : callable, optional
+        Called to release the connection of a streamed response
+    """
+    def __init__(self, status_code, headers, content=None, stream=None,
+                 close=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self._content = content
+        self._stream = stream
+        self._close = close
+
+    @property
+    def content(self):
+        """Body of the response"""
+        if self._content is None:
+            self._content = b''.join(self._stream(65536))
+            self.close()
+        return self._content
+
+    def json(self):
+        """Decode the body as JSON"""
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=65536):
+        """Iterate over the body in pieces of at most ``chunk_size`` bytes"""
+        if self._content is not None:
+            for start in range(0, len(self._content), chunk_size):
+                yield self._content[start:start + chunk_size]
+        else:
+            yield from self._stream(chunk_size)
+
+    def close(self):
+        """Release the connection of a streamed response"""
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Transport(abc.ABC):
+    """
+    Interface between :class:`.PHPWebService` and the web service
+
+    Subclasses implement :meth:`request` and raise :class:`TransportError`
+    when the web service can not be reached or times out, whatever client
+    library they use.
+    """
+    @abc.abstractmethod
+    def request(self, method, url, params=None, data=None, files=None,
+                headers=None, auth=None, stream=False):
+        """
+        Make a single request
+
+        Parameters
+        ----------
+        method : str
+            HTTP method
+
+        url : str
+            URL of the request
+
+        params : dict, optional
+            Query parameters to add to the URL
+
+        data : dict, optional
+            Form fields of the body
+
+        files : list, optional
+            ``(field, (filename, fileobj, content_type))`` for each file to
+            upload as multipart form data
+
+        headers : dict, optional
+            Extra request headers
+
+        auth : tuple, optional
+            Username and password for basic authentication
+
+        stream : bool, optional
+            Defer reading the body until it is iterated over
+
+        Returns
+        -------
+        response : Response
+
+        Raises
+        ------
+        TransportError
+            If the web service could not be reached or timed out
+        """
+
+    def close(self):
+        """Release any connections held by the transport"""
+
+
+class RequestsTransport(Transport):
+    """
+    Transport using a pooled ``requests.Session``
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Maximum number of connections kept open to the web service
+
+    timeout : float, optional
+        Seconds to wait to connect and for each read from the web service
+    """
+    _classes = (requests.ConnectTimeout, requests.Timeout,
+                requests.ConnectionError)
+
+    def __init__(self, pool_size=10, timeout=60.0):
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def request(self, method, url, params=None, data=None, files=None,
+                headers=None, auth=None, stream=False):
+        try:
+            result = self._session.request(method, url, params=params,
+                                           data=data, files=files,
+                                           headers=headers, auth=auth,
+                                           stream=stream,
+                                           timeout=self.timeout)
+            if not stream:
+                return Response(result.status_code, result.headers,
+                                content=result.content)
+        except requests.RequestException as exc:
+            raise _transport_error(exc, 'Failed to reach Web Service: {}',
+                                   *self._classes) from exc
+        return Response(result.status_code, result.headers,
+                        stream=_translate_errors(result.iter_content,
+                                                 requests.RequestException,
+                                                 self._classes),
+                        close=result.close)
+
+    def close(self):
+        self._session.close()
+
+
+class HTTPXTransport(Transport):
+    """
+    Transport using ``httpx``, optionally over HTTP/2
+
+    With HTTP/2, concurrent requests from many threads share a single
+    connection to the web service instead of each taking a connection from
+    a pool. This requires the ``httpx`` package, and ``h2`` for HTTP/2.
+
+    Parameters
+    ----------
+    http2 : bool, optional
+        Negotiate HTTP/2 with servers that support it
+
+    max_connections : int, optional
+        Maximum number of connections to the web service
+
+    timeout : float, optional
+        Seconds to wait to connect and for each read from the web service
+    """
+    def __init__(self, http2=True, max_connections=10, timeout=60.0):
+        try:
+            import httpx
+        except ImportError as exc:
+            raise ImportError("HTTPXTransport requires httpx, install "
+                              "elog[http2]") from exc
+        self._errors = httpx.TransportError
+        self._classes = (httpx.ConnectTimeout, httpx.TimeoutException,
+                         (httpx.NetworkError, httpx.ProtocolError))
+        self._client = httpx.Client(
+            http2=http2, timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections))
+
+    def request(self, method, url, params=None, data=None, files=None,
+                headers=None, auth=None, stream=False):
+        try:
+            request = self._client.build_request(method, url, params=params,
+                                                 data=data, files=files,
+                                                 headers=headers)
+            result = self._client.send(request, auth=auth, stream=stream)
+            if not stream:
+                return Response(result.status_code, result.headers,
+                                content=result.content)
+        except self._errors as exc:
+            raise _transport_error(exc, 'Failed to reach Web Service: {}',
+                                   *self._classes) from exc
+        return Response(result.status_code, result.headers,
+                        stream=_translate_errors(result.iter_bytes,
+                                                 self._errors,
+                                                 self._classes),
+                        close=result.close)
+
+    def close(self):
+        self._client.close()
+
+
+class InMemoryTransport(Transport):
+    """
+    Transport serving requests from a :class:`.MockLogbook` in-process
+
+    Requests are encoded exactly as :class:`RequestsTransport` would send
+    them and handed straight to the logbook, skipping the network.
+
+    Parameters
+    ----------
+    logbook : MockLogbook
+        Logbook that serves the requests
+    """
+    def __init__(self, logbook):
+        self.logbook = logbook
+
+    def request(self, method, url, params=None, data=None, files=None,
+                headers=None, auth=None, stream=False):
+        prepared = requests.Request(method, url, params=params, data=data,
+                                    files=files, headers=headers,
+                                    auth=auth).prepare()
+        body = prepared.body or b''
+        if isinstance(body, str):
+            body = body.encode()
+        status, headers, content = self.logbook.handle(
+            prepared.method, prepared.url, dict(prepared.headers), body)
+        return Response(status, headers, content=content)
@@ -5,13 +5,16 @@ Utility functions for PCDS ELog
 primary_elog = None
 registry = set()
 
+# Instruments whose facility logbooks use an upper case name
+legacy_instruments = ['dia', 'mfx', 'mec', 'cxi', 'xcs', 'xpp', 'sxr', 'amo']
+# Instruments in operation, as used by FacilityELog
+instruments = ['MFX', 'MEC', 'CXI', 'XCS', 'XPP', 'TMO', 'RIX', 'TXI']
+
 
 def facility_name(hutch):
     """Return the facility name for an instrument"""
-    if hutch in [
-        'dia', 'mfx', 'mec', 'cxi', 'xcs', 'xpp', 'sxr', 'amo',
-        'DIA', 'MFX', 'MEC', 'CXI', 'XCS', 'XPP', 'SXR', 'AMO',
-    ]:
+    if hutch in legacy_instruments + [name.upper()
+                                      for name in legacy_instruments]:
         return f'{hutch.upper()}_Instrument'
     return f'{hutch.lower()}_Instrument'
 
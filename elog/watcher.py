@@ -0,0 +1,93 @@
+"""
+Background monitoring of the active experiment
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ExperimentWatcher:
+    """
+    Follow experiment changeovers for a :class:`.HutchELog`
+
+    A daemon thread polls the web service for the active experiment of the
+    instrument every ``interval`` seconds. Lookups go through the metadata
+    cache of the service, so the web service only sends a body when the
+    experiment has changed. When it does, the ``experiment`` entry of
+    ``HutchELog.logbooks`` is replaced with a single item assignment. Posting
+    reads the logbook ID once per post, so posts in flight are unaffected and
+    no lock is needed on the posting path.
+
+    Parameters
+    ----------
+    elog : HutchELog
+        Client whose experiment logbook should be kept up to date
+
+    interval : float, optional
+        Time in seconds between polls
+
+    callback : callable, optional
+        Called as ``callback(old=old_id, new=new_id)`` from the watcher
+        thread after the experiment logbook has been swapped
+    """
+    def __init__(self, elog, interval=60.0, callback=None):
+        self.elog = elog
+        self.interval = interval
+        self.callback = callback
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        """Whether the watcher thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start polling in a background thread"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True,
+            name=f'ExperimentWatcher-{self.elog.instrument}')
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop polling, waiting up to ``timeout`` for the thread to exit"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Failed to check the active experiment "
+                                 "for %s", self.elog.instrument)
+
+    def poll(self):
+        """
+        Check the active experiment once
+
+        Returns
+        -------
+        changed : bool
+            Whether the experiment logbook was swapped
+        """
+        logbook_id = self.elog.service.get_experiment_logbook(
+            self.elog.instrument, station=self.elog.station)
+        old = self.elog.logbooks.get('experiment')
+        if logbook_id == old:
+            return False
+        logger.info("Experiment for %s changed from %s to %s",
+                    self.elog.instrument, old, logbook_id)
+        self.elog.logbooks['experiment'] = logbook_id
+        if self.callback is not None:
+            try:
+                self.callback(old=old, new=logbook_id)
+            except Exception:
+                logger.exception("Experiment change callback failed")
+        return True